@@ -0,0 +1,116 @@
+"""
+Micro-benchmark of the lexer on a large generated source, resembling unrolled lookup tables.
+The previous character-by-character tokenizer is kept here as the reference implementation.
+
+Usage: python3 benchmarks/lex_bench.py [number of lines]
+"""
+import io
+import math
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import g
+import lex
+from lex import TokenType, Token
+
+
+def generate_source(lines: int) -> str:
+    return ''.join(f'bank{i % 4 + 1}[{i % 512}] = {math.sin(i):.15f} * amplitude_scale + phase_offset_{i % 8}'
+                   f'  # sin({i})\n' for i in range(lines))
+
+
+class _Reference:
+    file = None
+    tokens = []
+    line_num = 1
+
+
+def reference_tokenize(source: str) -> int:
+    _Reference.file = io.StringIO(source)
+    _Reference.line_num = 1
+    count = 0
+    while _reference_read().type_ != TokenType.EOF:
+        count += 1
+    return count + 1
+
+
+def _reference_read() -> Token:
+    _reference_fill_tokens()
+    return _Reference.tokens.pop(0)
+
+
+def _reference_fill_tokens():
+    while not _Reference.tokens:
+        line = _Reference.file.readline()
+        if line:
+            _reference_tokenize_line(line, _Reference.line_num, _Reference.tokens)
+            _Reference.line_num += 1
+        else:
+            _Reference.tokens.append(Token(TokenType.EOF, None, _Reference.line_num, 1))
+
+
+def _reference_tokenize_line(line: str, line_num: int, tokens: list):
+    line += ' '
+    i = 0
+    while True:
+        while i < len(line) and line[i].isspace():
+            i += 1
+        if i == len(line):
+            break
+        if line[i:i + 2] in lex._operators:
+            tokens.append(Token(lex._operators[line[i:i + 2]], None, line_num, i + 1))
+            i += 2
+        elif line[i] in lex._operators:
+            tokens.append(Token(lex._operators[line[i]], None, line_num, i + 1))
+            i += 1
+        elif line[i].isdigit() or line[i] == '.':
+            start = i
+            accept_point = True
+            while line[i].isdigit() or (accept_point and line[i] == '.'):
+                if line[i] == '.':
+                    accept_point = False
+                i += 1
+            tokens.append(Token(TokenType.Number, line[start:i], line_num, start + 1))
+        elif line[i].isalpha() or line[i] == '_' or line[i] == '@':
+            start = i
+            i += 1
+            while line[i].isalnum() or line[i] == '_':
+                i += 1
+            keyword_type = lex._keywords.get(line[start:i])
+            if keyword_type is not None:
+                tokens.append(Token(keyword_type, None, line_num, start + 1))
+            else:
+                tokens.append(Token(TokenType.Identifier, line[start:i], line_num, start + 1))
+        elif line[i] == '$':
+            tokens.append(Token(TokenType.RawStmt, line[i + 1:].strip(), line_num, i + 1))
+            break
+        elif line[i] == '#':
+            break
+        else:
+            raise g.ParseError('Invalid token', line_num, i + 1)
+
+
+def tokenize(source: str) -> int:
+    count = 0
+    with g.compiling(g.CompilationUnit(io.StringIO(source))):
+        while lex.read().type_ != TokenType.EOF:
+            count += 1
+    return count + 1
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    source = generate_source(lines)
+    count = tokenize(source)
+    assert count == reference_tokenize(source)
+
+    for name, func in [('reference', reference_tokenize), ('lex', tokenize)]:
+        seconds = min(timeit.repeat(lambda: func(source), number=1, repeat=7))
+        print(f'{name:>10}: {seconds * 1000:8.1f} ms, {count / seconds / 1e6:6.2f} M tokens/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Peak memory of compiling a large generated program, measured with tracemalloc.
+Each compiler directory is measured in its own process, so the current tree can be compared with a checkout
+of another version, e.g. one created by `git worktree add`.
+
+Usage: python3 benchmarks/memory_bench.py [--lines N] [compiler_dir ...]
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def generate_source(lines: int) -> str:
+    parts = ['def lerp(a, b, t) {\n    return a + (b - a) * t\n}\n']
+    for i in range(lines // 4):
+        parts.append(f'x{i % 97} = -(y{i % 89} * {i} + ~z) // 3\n'
+                     f'if (!(x{i % 97} < {i}) && abs(w) > {i % 7}) {{\n'
+                     f'    cell1[{i % 64}] = lerp(x{i % 97}, -{i}, 0.5)\n'
+                     f'}}\n')
+    return ''.join(parts)
+
+
+class _Discard(io.TextIOBase):
+    def write(self, s: str) -> int:
+        return len(s)
+
+
+def measure(compiler_dir: str, source_path: str) -> dict:
+    sys.path.insert(0, compiler_dir)
+    import mindc
+
+    with open(source_path) as f:
+        tracemalloc.start()
+        with redirect_stdout(_Discard()):
+            mindc.do_compile(f)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {'peak': peak}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=40000)
+    parser.add_argument('--measure', nargs=2, metavar=('COMPILER_DIR', 'SOURCE'), help=argparse.SUPPRESS)
+    parser.add_argument('compilers', nargs='*', default=[ROOT])
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(*args.measure)))
+        return
+
+    with tempfile.NamedTemporaryFile('w', suffix='.mind', delete=False) as f:
+        f.write(generate_source(args.lines))
+    try:
+        for compiler_dir in args.compilers:
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', compiler_dir, f.name],
+                                 check=True, stdout=subprocess.PIPE, universal_newlines=True, cwd=compiler_dir).stdout
+            result = json.loads(out)
+            print(f'{compiler_dir}: peak {result["peak"] / 1024 / 1024:.1f} MiB')
+    finally:
+        os.remove(f.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Micro-benchmark of the parser on a large generated source of long arithmetic expressions and constant tables.
+The previous parser, descending through a function for each level of precedence, is kept here as the reference
+implementation, and must build the same syntax trees.
+
+Usage: python3 benchmarks/parse_bench.py [number of lines]
+"""
+import io
+import os
+import sys
+import timeit
+from typing import Callable, Dict, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import g
+import lex
+import syntax
+from ir import Expression, OperationExpr, LogicalExpr
+from lex import TokenType
+
+
+def generate_source(lines: int) -> str:
+    parts = []
+    for i in range(lines):
+        if i % 2:
+            parts.append(f'bank{i % 4 + 1}[{i % 512}] = {i * 0.37:.6f} * scale + offset_{i % 8}\n')
+        else:
+            parts.append(f'x{i % 97} = (a{i % 7} + {i}) * b - c / {i % 5 + 1} ** 2 << 1 | d & e ^ f % 3 '
+                         f'+ -(g // {i % 9 + 1}) - ~h * (k + m * (n - p))\n'
+                         f'ok{i % 13} = x{i % 97} >= {i} && !(y < z) || w == {i % 3} && v != 0\n')
+    return ''.join(parts)
+
+
+def _reference_chain(sub_expr_parser: Callable[[], Expression], set_bool: Optional[bool], ops: Dict[TokenType, str],
+                     type_is_bool: bool = False) -> Callable[[], Expression]:
+    def parser() -> Expression:
+        exp = sub_expr_parser()
+        while syntax._peek() in ops:
+            op = ops[lex.read().type_]
+            exp = OperationExpr(op, exp, sub_expr_parser(), set_bool)
+            if type_is_bool:
+                exp.type_is_bool = True
+        return exp
+
+    return parser
+
+
+_pow_exp = _reference_chain(syntax.unary_exp, None, {TokenType.PowOp: 'pow'})
+_mul_exp = _reference_chain(_pow_exp, None, {TokenType.MulOp: 'mul', TokenType.DivOp: 'div', TokenType.ModOp: 'mod',
+                                             TokenType.FloorDivOp: 'idiv'})
+_plus_exp = _reference_chain(_mul_exp, False, {TokenType.AddOp: 'add', TokenType.SubOp: 'sub'})
+_shift_exp = _reference_chain(_plus_exp, False, {TokenType.LShiftOp: 'shl', TokenType.RShiftOp: 'shr'})
+_comp_exp = _reference_chain(_shift_exp, True, {TokenType.LtOp: 'lessThan', TokenType.GtOp: 'greaterThan',
+                                                TokenType.LeqOp: 'lessThanEq', TokenType.GeqOp: 'greaterThanEq'}, True)
+_eq_exp = _reference_chain(_comp_exp, True, {TokenType.EqOp: 'equal', TokenType.NeqOp: 'notEqual'}, True)
+_b_and_exp = _reference_chain(_eq_exp, None, {TokenType.BAndOp: 'and'})
+_b_xor_exp = _reference_chain(_b_and_exp, None, {TokenType.BXorOp: 'xor'})
+_b_or_exp = _reference_chain(_b_xor_exp, None, {TokenType.BOrOp: 'or'})
+
+
+def _l_and_exp() -> Expression:
+    exp = _b_or_exp()
+    while syntax._peek() == TokenType.LAndOp:
+        lex.read()
+        exp = LogicalExpr('and', exp, _b_or_exp())
+    return exp
+
+
+def reference_expression() -> Expression:
+    exp = _l_and_exp()
+    while syntax._peek() == TokenType.LOrOp:
+        lex.read()
+        exp = LogicalExpr('or', exp, _l_and_exp())
+    return exp
+
+
+def parse(source: str, expression: Callable[[], Expression]):
+    """
+    :param expression: The expression parser for the statement parsers to use.
+    :return: The syntax tree.
+    """
+    current = syntax.expression
+    syntax.expression = expression
+    try:
+        with g.compiling(g.CompilationUnit(io.StringIO(source))):
+            return syntax.program()
+    finally:
+        syntax.expression = current
+
+
+def dump(node: object) -> object:
+    """
+    :return: The fields of a syntax tree, with nested nodes dumped as well, for comparison.
+    """
+    if isinstance(node, list):
+        return [dump(item) for item in node]
+    if not hasattr(node, '__slots__'):
+        return node
+    fields = [type(node).__name__]
+    for cls in type(node).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if name != 'label' and not name.endswith('_label'):  # labels are numbered by the unit
+                fields.append((name, dump(getattr(node, name, None))))
+    return fields
+
+
+def max_nesting(expression: Callable[[], Expression]) -> int:
+    """
+    :return: The deepest parentheses parsed without exceeding the recursion limit, by bisection.
+    """
+    low, high = 1, sys.getrecursionlimit()
+    while low < high:
+        depth = (low + high + 1) // 2
+        try:
+            parse('x = ' + '(' * depth + 'y' + ')' * depth + '\n', expression)
+            low = depth
+        except RecursionError:
+            high = depth - 1
+    return low
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    source = generate_source(lines)
+    assert dump(parse(source, syntax.expression).main_procedure) == \
+        dump(parse(source, reference_expression).main_procedure)
+    nodes = parse(source, syntax.expression).count_nodes()
+
+    for name, expression in [('reference', reference_expression), ('syntax', syntax.expression)]:
+        seconds = min(timeit.repeat(lambda: parse(source, expression), number=1, repeat=5))
+        print(f'{name:>10}: {seconds * 1000:8.1f} ms, {nodes / seconds / 1e6:6.2f} M nodes/s, '
+              f'parentheses nested up to {max_nesting(expression)}')
+
+
+if __name__ == '__main__':
+    main()
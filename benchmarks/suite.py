@@ -0,0 +1,224 @@
+"""
+Benchmark suite of the compiler: compile throughput, peak memory and the number of instructions emitted,
+on generated programs of scaling size and on the examples in docs/.
+Results are written as JSON, and can be compared with those of an earlier run to flag regressions:
+a throughput or memory regression beyond the tolerance, or any increase in the number of instructions.
+
+Usage: python3 benchmarks/suite.py [--scale X] [--output FILE] [--baseline FILE] [--compiler DIR]
+
+To track regressions, save the results of a reference version on the same machine as the baseline, e.g.
+    python3 benchmarks/suite.py --output baseline.json
+and compare later runs with it:
+    python3 benchmarks/suite.py --baseline baseline.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import re
+import sys
+import timeit
+import tracemalloc
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def nesting_source(blocks: int, depth: int = 40) -> str:
+    """
+    Blocks of `if` and `while` statements nested `depth` levels deep.
+    """
+    parts = []
+    for b in range(blocks):
+        for d in range(depth):
+            indent = '    ' * d
+            if d % 2 == 0:
+                parts.append(f'{indent}if (v{d} > {b}) {{\n')
+            else:
+                parts.append(f'{indent}while (v{d} < {d}) {{\n')
+            parts.append(f'{indent}    v{d} = v{d} + {b % 7 + 1}\n')
+        for d in range(depth - 1, -1, -1):
+            parts.append('    ' * d + '}\n')
+    return ''.join(parts)
+
+
+def expressions_source(lines: int, terms: int = 48) -> str:
+    """
+    Assignments of long expressions mixing operators, calls of built-in functions and parentheses,
+    with each variable assigned printed at the end so that its last value is not removed as dead.
+    """
+    operators = ['+', '*', '-', '//', '&', '<<', '|', '%']
+    parts = []
+    for i in range(lines):
+        expr = f'a{i % 13}'
+        for t in range(1, terms):
+            operand = f'max(b{t % 11}, {t})' if t % 5 == 0 else f'(c{t % 17} - {i % 29})' if t % 3 == 0 else f'd{t}'
+            expr += f' {operators[(i + t) % len(operators)]} {operand}'
+        parts.append(f'x{i % 101} = {expr}\n')
+    parts.extend(f'$ print x{i}\n' for i in range(min(lines, 101)))
+    return ''.join(parts)
+
+
+def functions_source(functions: int) -> str:
+    """
+    Many functions, each calling the one defined before it, all called from the main procedure.
+    """
+    parts = ['def f0(a, b) {\n    return a * b + 1\n}\n']
+    for i in range(1, functions):
+        parts.append(f'def f{i}(a, b) {{\n'
+                     f'    if (a > {i % 10}) {{\n'
+                     f'        return f{i - 1}(a - 1, b) + {i}\n'
+                     f'    }}\n'
+                     f'    c = b * {i % 7 + 2}\n'
+                     f'    while (c > a) {{\n'
+                     f'        c = c // 2\n'
+                     f'    }}\n'
+                     f'    return c\n'
+                     f'}}\n')
+    parts.extend(f'r{i % 50} = f{i}(p{i % 13}, q{i % 7})\n' for i in range(functions))
+    return ''.join(parts)
+
+
+def raw_source(lines: int) -> str:
+    """
+    Raw statements only, like code pasted from the game.
+    """
+    return ''.join(f'$ ucontrol move {i % 300} {i * 7 % 300} 0 0 0\n' if i % 3 else
+                   f'$ sensor s{i % 17} unit{i % 5} @health\n' for i in range(lines))
+
+
+def mixed_source(lines: int) -> str:
+    """
+    A mix of assignments, conditions, memory access and calls, a few lines at a time.
+    """
+    parts = ['def lerp(a, b, t) {\n    return a + (b - a) * t\n}\n']
+    for i in range(lines // 4):
+        parts.append(f'x{i % 97} = -(y{i % 89} * {i} + ~z) // 3\n'
+                     f'if (!(x{i % 97} < {i}) && abs(w) > {i % 7}) {{\n'
+                     f'    cell1[{i % 64}] = lerp(x{i % 97}, -{i}, 0.5)\n'
+                     f'}}\n')
+    return ''.join(parts)
+
+
+def doc_examples() -> Dict[str, str]:
+    """
+    :return: The code blocks of the English examples in docs/, by name.
+    """
+    examples = {}
+    for name in sorted(os.listdir(os.path.join(ROOT, 'docs'))):
+        if re.fullmatch(r'example\d*\.md', name):
+            with open(os.path.join(ROOT, 'docs', name), encoding='utf-8') as f:
+                blocks = re.findall(r'^```[^\n]*\n(.*?)^```', f.read(), re.MULTILINE | re.DOTALL)
+            for i, block in enumerate(blocks):
+                examples[f'docs/{name}' + (f'#{i + 1}' if len(blocks) > 1 else '')] = block
+    return examples
+
+
+def corpus(scale: float) -> List[Tuple[str, str]]:
+    """
+    :return: `(name, source)` of each program benchmarked. The generated ones grow with `scale`.
+    """
+    def n(count: int) -> int:
+        return max(1, round(count * scale))
+
+    generated: List[Tuple[str, Callable[[int], str], int]] = [
+        ('nesting', nesting_source, 100),
+        ('expressions', expressions_source, 2000),
+        ('functions', functions_source, 1000),
+        ('raw', raw_source, 100000),
+        ('mixed', mixed_source, 40000),
+    ]
+    programs = list(doc_examples().items())
+    programs.extend((f'{name}-{n(count)}', func(n(count))) for name, func, count in generated)
+    return programs
+
+
+def compile_source(source: str) -> List[str]:
+    import mindc
+
+    if hasattr(mindc, 'compile'):
+        return mindc.compile(source)
+    # versions before the library interface only print the code
+    out = io.StringIO()
+    with redirect_stdout(out):
+        mindc.do_compile(io.StringIO(source))
+    return out.getvalue().splitlines()
+
+
+def measure(source: str, repeat: int) -> Dict[str, float]:
+    lines = source.count('\n') + (not source.endswith('\n'))
+    code = compile_source(source)
+    seconds = min(timeit.repeat(lambda: compile_source(source), number=1, repeat=repeat))
+    tracemalloc.start()
+    compile_source(source)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'lines': lines, 'seconds': seconds, 'lines_per_second': lines / seconds, 'peak_bytes': peak,
+            'instructions': len(code)}
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            tolerance: float) -> List[str]:
+    """
+    :return: A description of each regression from `baseline`.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['lines_per_second'] < before['lines_per_second'] * (1 - tolerance):
+            regressions.append(f'{name}: throughput {before["lines_per_second"]:.0f} -> '
+                               f'{result["lines_per_second"]:.0f} lines/s')
+        if result['peak_bytes'] > before['peak_bytes'] * (1 + tolerance):
+            regressions.append(f'{name}: peak memory {before["peak_bytes"] / 1024 / 1024:.1f} -> '
+                               f'{result["peak_bytes"] / 1024 / 1024:.1f} MiB')
+        if result['instructions'] > before['instructions']:
+            regressions.append(f'{name}: instructions {before["instructions"]} -> {result["instructions"]}')
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the compiler and compare with a baseline.')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='size of the generated programs relative to the defaults (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='compiles of each program timed, the fastest counts')
+    parser.add_argument('--only', metavar='REGEX', help='only benchmark programs whose names match REGEX')
+    parser.add_argument('--output', metavar='FILE', help='write the results to FILE as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='compare with the results in FILE')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative loss of throughput or growth of memory tolerated (default: %(default)s)')
+    parser.add_argument('--compiler', metavar='DIR', default=ROOT,
+                        help='directory of the compiler to benchmark, e.g. a checkout of another version')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.compiler))
+
+    results = {}
+    for name, source in corpus(args.scale):
+        if args.only is not None and not re.search(args.only, name):
+            continue
+        result = results[name] = measure(source, args.repeat)
+        print(f'{name:<24} {result["lines"]:>8} lines {result["lines_per_second"]:>10.0f} lines/s '
+              f'{result["peak_bytes"] / 1024 / 1024:>8.1f} MiB {result["instructions"]:>8} instructions')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'scale': args.scale, 'results': results}, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['scale'] != args.scale:
+            print(f'The baseline was measured at scale {baseline["scale"]}.', file=sys.stderr)
+            return 1
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import functools
+import glob
+import hashlib
+import os
+import tempfile
+from typing import Optional, List
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_directory() -> str:
+    directory = os.environ.get('MINDC_CACHE_DIR')
+    if directory:
+        return directory
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'mindc')
+
+
+@functools.lru_cache(maxsize=None)
+def compiler_version() -> str:
+    """
+    The project has no version number, so the compiler is identified by the digest of its own source files.
+    Any change to the compiler thus invalidates previously cached results.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class CompileCache:
+    """
+    Content-addressed on-disk cache of compiled code.
+    Entries are keyed by the digest of the source text, the compiler version and the compiling options.
+    When the total size exceeds `max_size`, the least recently used entries are removed.
+    Several processes may share a directory: entries are written atomically and may vanish at any time.
+    """
+
+    directory: str
+    max_size: int
+    _size: Optional[int]  # estimated total size of entries, `None` if not scanned yet
+
+    def __init__(self, directory: Optional[str] = None, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = directory if directory is not None else default_directory()
+        self.max_size = max_size
+        self._size = None
+
+    @staticmethod
+    def key(source: str, options: str = '') -> str:
+        digest = hashlib.sha256()
+        for part in (compiler_version(), options, source):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                content = f.read()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            return None
+        return content.splitlines()
+
+    def put(self, key: str, code: List[str]):
+        path = self._path(key)
+        content = ''.join(inst + '\n' for inst in code)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except OSError:
+            return  # the cache is an optimization, failing to fill it is not an error
+
+        if self._size is None:
+            self._size = sum(size for _, _, size in self._entries())
+        else:
+            self._size += len(content)
+        if self._size > self.max_size:
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove the least recently used entries until the total size is below 90% of the limit,
+        so that eviction is not triggered by every single insertion.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._size = total
+
+    def _entries(self):
+        """
+        :return: (last used time, path, size) of each entry.
+        """
+        try:
+            shards = [x for x in os.scandir(self.directory) if x.is_dir()]
+        except OSError:
+            return
+        for shard in shards:
+            try:
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.tmp'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield stat.st_mtime, entry.path, stat.st_size
+            except OSError:
+                continue
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key[2:])
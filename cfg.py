@@ -0,0 +1,308 @@
+"""
+Analysis of generated code, shared by the passes transforming it after generation.
+Passes work on a list of `Inst`, where jump targets are instruction indices instead of labels.
+A jump table, generated as `op add @counter @counter index` followed by a jump for each entry, is a single `Inst`,
+so passes keep its entries together.
+"""
+from typing import List, Optional, Set, Dict
+
+import g
+from ir import Label
+
+
+class Inst:
+    __slots__ = ('words', 'target', 'origin', 'table')
+
+    words: List[str]  # opcode and operands, the target of a generated jump is the placeholder '{}'
+    target: Optional[int]  # index of the instruction jumped to
+    origin: Optional[g.Origin]
+    table: Optional[List[int]]  # of a jump table, the index of the instruction each entry jumps to
+
+    def __init__(self, words: List[str], target: Optional[int] = None, origin: Optional[g.Origin] = None,
+                 table: Optional[List[int]] = None):
+        self.words = words
+        self.target = target
+        self.origin = origin
+        self.table = table
+
+    @property
+    def opcode(self) -> str:
+        return self.words[0]
+
+    def is_jump(self) -> bool:
+        return self.target is not None
+
+    def targets(self) -> List[int]:
+        """
+        :return: The indices of the instructions this instruction may jump to.
+        """
+        if self.table is not None:
+            return self.table
+        return [self.target] if self.target is not None else []
+
+    def is_unconditional_jump(self) -> bool:
+        return self.target is not None and self.words[2] == 'always'
+
+    def is_call(self, prev: Optional['Inst']) -> bool:
+        """
+        Function calls are generated as `op add $ra$f @counter 1` followed by `jump home always`.
+        :param prev: The preceding instruction.
+        """
+        return (self.is_unconditional_jump() and prev is not None and prev.words[:2] == ['op', 'add']
+                and prev.words[2].startswith('$ra$') and prev.words[3:] == ['@counter', '1'])
+
+    def is_return(self) -> bool:
+        return self.words[0] == 'set' and len(self.words) == 3 and self.words[1] == '@counter' \
+            and self.words[2].startswith('$ra$')
+
+    def ends_flow(self) -> bool:
+        """
+        :return: Whether the execution never continues with the next instruction.
+        """
+        return self.is_unconditional_jump() or self.is_return() or self.words[0] == 'end' or self.table is not None
+
+    def reads(self) -> List[str]:
+        """
+        :return: The variables (or constants) this instruction reads.
+        """
+        w = self.words
+        opcode = w[0]
+        if opcode in _write_first and len(w) == _write_first[opcode]:
+            return w[2:] if opcode != 'op' else w[3:]
+        if opcode == 'write' and len(w) == 4:
+            return w[1:]
+        if opcode == 'jump' and self.target is not None:
+            return w[3:] if w[2] != 'always' else []
+        if opcode in ('end', 'noop'):
+            return []
+        return w[1:]
+
+    def writes(self) -> Optional[str]:
+        """
+        :return: The variable this instruction surely writes, if any.
+        """
+        w = self.words
+        length = _write_first.get(w[0])
+        if length is not None and len(w) == length:
+            return w[2] if w[0] == 'op' else w[1]
+        return None
+
+    def may_write(self) -> List[str]:
+        """
+        :return: The variables this instruction may write. Raw instructions are assumed to write all their operands.
+        """
+        if self.is_known():
+            dest = self.writes()
+            return [dest] if dest is not None else []
+        return self.words[1:]
+
+    def is_known(self) -> bool:
+        """
+        :return: Whether the effects of this instruction are fully understood, i.e. it is in the form generated.
+        """
+        w = self.words
+        opcode = w[0]
+        if opcode in _write_first:
+            return len(w) == _write_first[opcode]
+        if opcode == 'write':
+            return len(w) == 4
+        if opcode == 'jump':
+            return self.target is not None
+        return opcode in ('end', 'noop') and len(w) == 1
+
+    def __repr__(self):
+        return ' '.join(self.words) + ''.join(f' -> {target}' for target in self.targets())
+
+
+_write_first = {'set': 3, 'op': 5, 'read': 4}  # opcodes writing their first variable, and their number of words
+
+
+def load(code: g.CodeBuffer) -> List[Inst]:
+    """
+    A jump table is generated as an instruction writing `@counter` with a label placed after the table,
+    followed by the jumps of the entries. Raw statements never have labels.
+    """
+    insts = []
+    index = []  # of the instruction from each instruction of the code
+    i = 0
+    while i < len(code):
+        words, label = code.words(i), code.label(i)
+        index.append(len(insts))
+        if label is not None and words[:4] == ['op', 'add', '@counter', '@counter']:
+            entries = range(i + 1, label.inst)
+            insts.append(Inst(words, None, code.origin(i), [code.label(k).inst for k in entries]))
+            index.extend(len(insts) for _ in entries)  # entries are not jumped to
+            i = label.inst
+        else:
+            insts.append(Inst(words, None if label is None else label.inst, code.origin(i)))
+            i += 1
+    index.append(len(insts))
+    for inst in insts:
+        if inst.target is not None:
+            inst.target = index[inst.target]
+        elif inst.table is not None:
+            inst.table = [index[target] for target in inst.table]
+    return insts
+
+
+def store(insts: List[Inst]) -> g.CodeBuffer:
+    code = g.CodeBuffer()
+    address = [0]  # of each instruction in the code, where entries of jump tables take their own
+    for inst in insts:
+        address.append(address[-1] + 1 + len(inst.table or ()))
+    labels: Dict[int, Label] = {}
+
+    def label_of(target: int) -> Label:
+        label = labels.get(target)
+        if label is None:
+            label = labels[target] = Label()
+            label.inst = address[target]
+        return label
+
+    for i, inst in enumerate(insts):
+        if inst.table is not None:
+            end = Label()
+            end.inst = address[i + 1]
+            code.append(' '.join(inst.words), end, inst.origin)
+            for target in inst.table:
+                code.append('jump {} always', label_of(target), inst.origin)
+        else:
+            code.append(' '.join(inst.words), None if inst.target is None else label_of(inst.target), inst.origin)
+    if len(insts) in labels:  # a jump to the end needs an instruction to land on
+        code.append('noop')
+    return code
+
+
+def has_opaque_control_flow(insts: List[Inst]) -> bool:
+    """
+    Raw statements may jump to absolute addresses or modify `@counter`.
+    Such code depends on the exact layout, which the passes must not change.
+    """
+    for inst in insts:
+        if inst.words[0] == 'jump' and inst.target is None:
+            return True
+        if '@counter' in inst.may_write() and not inst.is_return() and inst.table is None:
+            return True
+    return False
+
+
+def compact(insts: List[Inst], removed: Set[int]) -> List[Inst]:
+    """
+    Remove instructions, retargeting jumps to removed instructions to the next remaining one.
+    """
+    if not removed:
+        return insts
+    new_index = []
+    count = 0
+    for i in range(len(insts)):
+        new_index.append(count)
+        if i not in removed:
+            count += 1
+    new_index.append(count)
+    result = []
+    for i, inst in enumerate(insts):
+        if i not in removed:
+            if inst.target is not None:
+                inst.target = new_index[inst.target]
+            elif inst.table is not None:
+                inst.table = [new_index[target] for target in inst.table]
+            result.append(inst)
+    return result
+
+
+def successors(insts: List[Inst], i: int) -> List[int]:
+    """
+    Successors within a procedure: a function call continues with the next instruction,
+    while a return or an `end` leaves the procedure.
+    """
+    inst = insts[i]
+    if inst.table is not None:
+        return list(dict.fromkeys(inst.table))
+    if inst.target is not None:
+        if inst.words[2] != 'always':
+            return [inst.target, i + 1] if i + 1 < len(insts) else [inst.target]
+        if inst.is_call(insts[i - 1] if i > 0 else None):
+            return [i + 1] if i + 1 < len(insts) else []
+        return [inst.target]
+    if inst.ends_flow():
+        return []
+    return [i + 1] if i + 1 < len(insts) else []
+
+
+def block_starts(insts: List[Inst]) -> Set[int]:
+    """
+    :return: The indices of instructions starting a basic block.
+    """
+    starts = {0}
+    for i, inst in enumerate(insts):
+        if inst.target is not None or inst.table is not None:
+            starts.update(inst.targets())
+            starts.add(i + 1)
+        elif inst.ends_flow() or not inst.is_known():
+            starts.add(i + 1)
+    return starts
+
+
+def is_temp(word: str) -> bool:
+    return word.startswith(g.TEMP_PREFIX)
+
+
+def immediate_dominators(block_successors: List[List[int]]) -> List[Optional[int]]:
+    """
+    :param block_successors: The successors of each basic block.
+    :return: The immediate dominator of each block, or `None` for blocks without predecessors, i.e. entries
+        of procedures, and for blocks not dominated by a single entry, e.g. those never reached.
+    """
+    n = len(block_successors)
+    predecessors: List[List[int]] = [[] for _ in range(n)]
+    for b, succs in enumerate(block_successors):
+        for s in succs:
+            predecessors[s].append(b)
+    entries = [b for b in range(n) if not predecessors[b]]
+
+    # postorder numbers, with `n` standing for a root before all entries
+    post = [-1] * (n + 1)
+    order: List[int] = []
+    for entry in entries:
+        stack = [(entry, iter(block_successors[entry]))]
+        post[entry] = -2  # visiting
+        while stack:
+            b, succs = stack[-1]
+            for s in succs:
+                if post[s] == -1:
+                    post[s] = -2
+                    stack.append((s, iter(block_successors[s])))
+                    break
+            else:
+                stack.pop()
+                post[b] = len(order)
+                order.append(b)
+    post[n] = len(order)
+
+    idom: List[Optional[int]] = [None] * (n + 1)
+    idom[n] = n
+    for entry in entries:
+        idom[entry] = n
+
+    def intersect(a: int, b: int) -> int:
+        while a != b:
+            while post[a] < post[b]:
+                a = idom[a]
+            while post[b] < post[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for b in reversed(order):
+            if idom[b] == n and not predecessors[b]:
+                continue
+            new = None
+            for p in predecessors[b]:
+                if idom[p] is not None:
+                    new = p if new is None else intersect(p, new)
+            if new != idom[b]:
+                idom[b] = new
+                changed = True
+    return [None if d == n else d for d in idom[:n]]
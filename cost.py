@@ -0,0 +1,30 @@
+"""
+The cost model consulted by the optimizations trading the size of the code for its speed, like inlining,
+jump tables and the placement of loop conditions.
+A processor holds at most 1000 instructions, and every instruction takes the same time, so both sides are counted
+in instructions: those a change adds to the code, and those it saves on each run of the program. Code in a loop
+is assumed to run `LOOP_ITERATIONS` times for each loop it is in. `g.Options.speed_weight` sets the exchange rate.
+"""
+import g
+
+LOOP_ITERATIONS = 10  # assumed number of iterations of a loop, as the compiler cannot know it
+
+
+def frequency(depth: int) -> float:
+    """
+    :param depth: The number of loops some code is in.
+    :return: The assumed number of times the code runs on each run of the program.
+    """
+    return LOOP_ITERATIONS ** depth
+
+
+def worth(size: int, saved: float) -> bool:
+    """
+    Decide on a change under the options of the current unit. With `speed_weight` 0, the code is made as small
+    as possible, and speed only decides between changes of the same size.
+    :param size: The number of instructions the change adds to the code, negative if it removes some.
+    :param saved: The number of instructions it saves on each run of the program, negative if it adds some,
+        see `frequency`.
+    :return: Whether the change is worth making.
+    """
+    return saved * g.unit().options.speed_weight > size or size == 0 and saved > 0
@@ -0,0 +1,294 @@
+"""
+Common subexpression elimination by value numbering. An operation whose value is still held by a variable
+on every path reaching it is replaced by a copy of that variable, and temporaries only read through copies
+are read from the variables copied instead. Temporaries no longer read are then removed.
+Only operations that are pure functions of their operands take part. A value is lost when its variable or
+an operand is written, including by a raw statement, and at function calls, which may write any variable.
+Built-in variables like `@time` change by themselves, so operations reading them are never eliminated.
+Memory may be written by other processors, so reads only take part for the cells declared owned, which none
+does. The contents of an owned cell are followed as if they were a variable named after it: writing the cell,
+writing through a variable that may hold it, or running a raw statement not in a known form loses the values read,
+and the value written to an index is reused by the reads of it that follow.
+"""
+from typing import List, Dict, Set, Tuple, Optional, Collection
+
+import ops
+from cfg import Inst, is_temp, successors, block_starts, has_opaque_control_flow, compact, immediate_dominators
+
+_Key = Tuple[str, str, str]  # an operation and its operands, or `read` with a cell and an index
+
+_COMMUTATIVE = {'add', 'mul', 'equal', 'notEqual', 'land', 'or', 'and', 'xor', 'max', 'min'}
+
+
+class _Values:
+    """
+    What is known at a point of the code: the variables holding the values of operations,
+    and the variables holding copies of others. Each fact records the versions of the variables it involves,
+    and holds while they stay the same, so writing a variable only takes a new version.
+    Changes are logged, so the facts known at an earlier point can be restored.
+    """
+
+    __slots__ = ('holders', 'copies', 'versions', 'epoch', '_log', '_counter')
+
+    holders: Dict[_Key, Tuple[str, tuple]]  # operation -> variable holding its value, and the versions it holds at
+    copies: Dict[str, Tuple[str, tuple]]  # variable -> variable it holds a copy of, and the versions it holds at
+    versions: Dict[str, int]  # of variables written, changed on each write
+    epoch: int  # changed at function calls, which may write any variable
+    _log: List[Tuple[object, object, object]]  # (dictionary or `None` for the epoch, key, value before)
+    _counter: int  # last version given, so versions are never reused after restoring
+
+    def __init__(self):
+        self.holders = {}
+        self.copies = {}
+        self.versions = {}
+        self.epoch = 0
+        self._log = []
+        self._counter = 0
+
+    def holder(self, key: _Key) -> Optional[str]:
+        fact = self.holders.get(key)
+        if fact is None or fact[1] != self._stamp(key[1], key[2], fact[0]):
+            return None
+        return fact[0]
+
+    def canonical(self, var: str) -> str:
+        fact = self.copies.get(var)
+        if fact is None or fact[1] != self._stamp(var, fact[0]):
+            return var
+        return fact[0]
+
+    def add_operation(self, key: _Key, holder: str):
+        self._set(self.holders, key, (holder, self._stamp(key[1], key[2], holder)))
+
+    def add_copy(self, dest: str, src: str):
+        self._set(self.copies, dest, (src, self._stamp(dest, src)))
+
+    def write(self, var: str):
+        self._counter += 1
+        self._set(self.versions, var, self._counter)
+
+    def clear(self):
+        self._log.append((None, None, self.epoch))
+        self._counter += 1
+        self.epoch = self._counter
+
+    def mark(self) -> int:
+        return len(self._log)
+
+    def restore(self, mark: int):
+        """
+        Undo the changes since `mark` was taken.
+        """
+        log = self._log
+        while len(log) > mark:
+            table, key, value = log.pop()
+            if table is None:
+                self.epoch = value
+            elif value is None:
+                del table[key]
+            else:
+                table[key] = value
+
+    def _set(self, table: dict, key: object, value: object):
+        self._log.append((table, key, table.get(key)))
+        table[key] = value
+
+    def _stamp(self, *variables: str) -> tuple:
+        versions = self.versions
+        return (self.epoch,) + tuple(versions.get(var, 0) for var in variables)
+
+
+def eliminate(insts: List[Inst], owned: Collection[str] = ()) -> List[Inst]:
+    """
+    :param insts: The generated code.
+    :param owned: The memory cells and banks no other processor writes.
+    :return: The code with common subexpressions eliminated.
+    """
+    if has_opaque_control_flow(insts):
+        return insts
+    if any(not inst.is_known() and any(is_temp(w) for w in inst.words) for inst in insts):
+        return insts  # a raw statement refers to a temporary by name
+    starts = sorted(block_starts(insts) - {len(insts)})
+    if not starts:
+        return insts
+    block_of = {start: b for b, start in enumerate(starts)}
+    ends = starts[1:] + [len(insts)]
+    block_successors = [[block_of[s] for s in successors(insts, end - 1) if s in block_of] for end in ends]
+    predecessors: List[List[int]] = [[] for _ in starts]
+    for b, succs in enumerate(block_successors):
+        for s in succs:
+            predecessors[s].append(b)
+    idom = immediate_dominators(block_successors)
+
+    # what each block may write, `None` if it calls a function
+    writes: List[Optional[Set[str]]] = []
+    for start, end in zip(starts, ends):
+        written: Optional[Set[str]] = set()
+        for i in range(start, end):
+            if i > 0 and insts[i].is_call(insts[i - 1]):
+                written = None
+                break
+            written.update(_may_write(insts[i], owned))
+        writes.append(written)
+
+    # Blocks are visited down the dominator tree, each starting from what is known at the end of its immediate
+    # dominator, less what the paths from there may write. Blocks without predecessors are entries of the main
+    # procedure or of functions, where nothing is known, and blocks never reached are left alone.
+    children: List[List[int]] = [[] for _ in starts]
+    roots = []
+    for b, d in enumerate(idom):
+        if d is None:
+            if not predecessors[b]:
+                roots.append(b)
+        elif d != b:
+            children[d].append(b)
+    values = _Values()
+    for root in roots:
+        stack = [(root, values.mark())]
+        while stack:
+            b, mark = stack.pop()
+            if b < 0:
+                values.restore(mark)
+                continue
+            stack.append((-1, mark))
+            if idom[b] is not None:
+                written = _written_since(b, idom[b], predecessors, writes)
+                if written is None:
+                    values.clear()
+                else:
+                    for var in written:
+                        values.write(var)
+            _number(insts, starts[b], ends[b], values, owned)
+            inner = values.mark()
+            stack.extend((child, inner) for child in reversed(children[b]))
+    return _remove_unread(insts)
+
+
+def _written_since(block: int, dominator: int, predecessors: List[List[int]],
+                   writes: List[Optional[Set[str]]]) -> Optional[Set[str]]:
+    """
+    :return: What the paths from the end of `dominator` to the start of `block` may write,
+        or `None` if they may call a function.
+    """
+    written: Set[str] = set()
+    visited = {dominator}
+    pending = [p for p in predecessors[block] if p != dominator]
+    while pending:
+        b = pending.pop()
+        if b in visited:
+            continue
+        visited.add(b)
+        if writes[b] is None:
+            return None
+        written |= writes[b]
+        pending.extend(predecessors[b])
+    return written
+
+
+def _number(insts: List[Inst], start: int, end: int, values: _Values, owned: Collection[str]):
+    """
+    Follow the values through a basic block, replacing operations by copies, and reads of copies by their sources.
+    """
+    for i in range(start, end):
+        inst = insts[i]
+        if i > 0 and inst.is_call(insts[i - 1]):
+            values.clear()
+            continue
+        known = inst.is_known()
+        if known:
+            _read_sources(inst, values)
+        words = inst.words
+        key = _operation(inst, values, owned)
+        if key is not None:
+            dest = inst.writes()
+            holder = values.holder(key)
+            if holder is not None and holder != dest:
+                inst.words = words = ['set', dest, holder]
+            values.write(dest)
+            if dest in key:
+                continue
+            if holder is None or values.holder(key) is None:
+                values.add_operation(key, dest)
+            elif holder != dest:
+                values.add_copy(dest, holder)
+        else:
+            for var in _may_write(inst, owned):
+                values.write(var)
+            if known and inst.opcode == 'set':
+                dest, src = words[1], values.canonical(words[2])
+                if dest != src and not src.startswith('@') and not dest.startswith('@'):
+                    values.add_copy(dest, src)
+            elif known and inst.opcode == 'write' and words[2] in owned:
+                src, index = words[1], values.canonical(words[3])
+                if not src.startswith('@') and not index.startswith('@'):
+                    values.add_operation(('read', words[2], index), src)  # forward the store to later reads
+
+
+def _operation(inst: Inst, values: _Values, owned: Collection[str]) -> Optional[_Key]:
+    """
+    :return: The operation computed by `inst` with operands replaced by the variables they are copies of,
+        or `None` if `inst` is not a pure operation, nor a read of an owned cell.
+    """
+    words = inst.words
+    if words[0] == 'read' and len(words) == 4 and words[2] in owned:
+        index = values.canonical(words[3])
+        return None if index.startswith('@') else ('read', words[2], index)
+    if words[0] != 'op' or len(words) != 5 or words[1] not in ops.OPERATIONS:
+        return None
+    a, b = values.canonical(words[3]), values.canonical(words[4])
+    if a.startswith('@') or b.startswith('@'):
+        return None
+    if words[1] in _COMMUTATIVE and b < a:
+        a, b = b, a
+    return words[1], a, b
+
+
+def _may_write(inst: Inst, owned: Collection[str]) -> List[str]:
+    """
+    :return: The variables `inst` may write, and the owned cells whose contents it may write.
+    """
+    if not inst.is_known():
+        return inst.may_write() + list(owned)
+    if inst.opcode == 'write':
+        # a cell written through a variable holding it, like `c = cell1`, may be any of them
+        return [inst.words[2]] if inst.words[2] in owned else list(owned)
+    return inst.may_write()
+
+
+def _read_sources(inst: Inst, values: _Values):
+    """
+    Read temporaries holding copies from the variables they are copies of.
+    """
+    opcode = inst.opcode
+    start = 3 if opcode == 'op' else 2 if opcode in ('set', 'read') else 1
+    words = inst.words
+    for j in range(start, len(words)):
+        if is_temp(words[j]):
+            words[j] = values.canonical(words[j])
+
+
+def _remove_unread(insts: List[Inst]) -> List[Inst]:
+    """
+    Remove copies and pure operations into temporaries never read.
+    """
+    reads: Dict[str, int] = {}
+    definitions: Dict[str, List[int]] = {}  # the copies and operations into each temporary
+    for i, inst in enumerate(insts):
+        for word in inst.reads():
+            if is_temp(word):
+                reads[word] = reads.get(word, 0) + 1
+        if inst.is_known() and (inst.opcode == 'set' or inst.opcode == 'op' and inst.words[1] in ops.OPERATIONS):
+            dest = inst.writes()
+            if is_temp(dest):
+                definitions.setdefault(dest, []).append(i)
+    removed: Set[int] = set()
+    unread = [temp for temp in definitions if not reads.get(temp)]
+    while unread:
+        for i in definitions.pop(unread.pop(), ()):
+            removed.add(i)
+            for word in insts[i].reads():
+                if is_temp(word):
+                    reads[word] -= 1
+                    if not reads[word]:
+                        unread.append(word)
+    return compact(insts, removed)
@@ -0,0 +1,61 @@
+"""
+Removal of dead stores: copies, pure operations and memory reads into variables no instruction reads.
+All variables are global and keep their values across runs of the program, so the analysis covers the whole code
+at once, regardless of control flow: a variable is read if any instruction reads it, including the next run,
+other than to compute the values of variables not read themselves.
+Raw statements not in a known form are assumed to read every word of them, so a variable only printed
+or sensed by raw statements is kept.
+Built-in variables like `@counter` and the return addresses of functions are never removed.
+"""
+from typing import List, Dict, Set, Tuple, Optional
+
+import g
+import ops
+from cfg import Inst, is_temp, has_opaque_control_flow, compact
+
+
+def eliminate(insts: List[Inst],
+              removed_stores: Optional[List[Tuple[str, Optional[g.Origin]]]] = None) -> List[Inst]:
+    """
+    :param insts: The generated code.
+    :param removed_stores: If given, the variable and the origin of each statement whose stores are removed
+        are appended to it, leaving out temporaries, which the source does not name.
+    :return: The code without dead stores.
+    """
+    if has_opaque_control_flow(insts):
+        return insts  # raw jumps to fixed addresses would land elsewhere
+    # variables are live if read by an instruction kept anyway, or by a store into a live variable,
+    # so a counter only read to update itself is dead
+    stores: Dict[str, List[int]] = {}  # the removable stores into each variable
+    live: Set[str] = set()
+    pending: List[str] = []
+    for i, inst in enumerate(insts):
+        if _is_removable(inst):
+            stores.setdefault(inst.writes(), []).append(i)
+        else:
+            pending.extend(inst.reads())
+    while pending:
+        var = pending.pop()
+        if var not in live:
+            live.add(var)
+            for i in stores.get(var, ()):
+                pending.extend(insts[i].reads())
+    removed = {i for var, indices in stores.items() if var not in live for i in indices}
+    if removed_stores is not None:
+        # the copies of a statement in each place a function is inlined are reported once
+        removed_stores.extend(dict.fromkeys((insts[i].writes(), insts[i].origin) for i in sorted(removed)
+                                            if not is_temp(insts[i].writes())))
+    return compact(insts, removed)
+
+
+def _is_removable(inst: Inst) -> bool:
+    """
+    :return: Whether `inst` only writes a variable, without other effects.
+    """
+    if not inst.is_known():
+        return False
+    words = inst.words
+    if not (words[0] in ('set', 'read') or words[0] == 'op' and words[1] in ops.OPERATIONS):
+        return False
+    dest = inst.writes()
+    return not dest.startswith('@') and not dest.startswith('$ra$')
@@ -1,8 +1,319 @@
-from typing import TextIO, List, Tuple, Any
+import copy
+import threading
+from array import array
+from collections import deque
+from contextlib import contextmanager
+from typing import TextIO, List, Tuple, Any, Iterator, Optional, Deque, Dict
 
-file: TextIO
-context: list = []
-code: List[Tuple[str, Any]] = []  # type of the 2nd component is Optional[ir.Label]
+TEMP_PREFIX = '$tmp$'
+
+# where an instruction comes from: line and column of the statement, and the function containing it (`None` for main)
+Origin = Tuple[int, int, Optional[str]]
+
+
+class CodeBuffer:
+    """
+    Compact storage of generated instructions.
+    Each distinct word (opcode or operand) is stored once in a string table, and an instruction is stored
+    as a run of indices into that table. Temporary variables are rarely used more than a few times,
+    so instead of occupying the table, their numbers are stored directly, tagged by `_TEMP_FLAG`.
+    Labels are kept in a separate map, since most instructions have none.
+    Origins are stored as indices into a table, as consecutive instructions mostly share them.
+    Items are `(instruction, label)` tuples, where the type of `label` is `Optional[ir.Label]`.
+    """
+
+    __slots__ = ('_strings', '_string_ids', '_words', '_starts', '_labels', '_origins', '_origin_table',
+                 '_origin_ids')
+
+    _TEMP_FLAG = 1 << 31
+
+    _strings: List[str]
+    _string_ids: Dict[str, int]
+    _words: array  # indices into `_strings`
+    _starts: array  # instruction `i` consists of `_words[_starts[i]:_starts[i + 1]]`
+    _labels: Dict[int, Any]
+    _origins: array  # indices into `_origin_table`
+    _origin_table: List[Optional[Origin]]
+    _origin_ids: Dict[Optional[Origin], int]
+
+    def __init__(self):
+        self._strings = []
+        self._string_ids = {}
+        self._words = array('I')
+        self._starts = array('I', [0])
+        self._labels = {}
+        self._origins = array('I')
+        self._origin_table = [None]
+        self._origin_ids = {None: 0}
+
+    def append(self, instruction: str, label: Any = None, origin: Optional[Origin] = None):
+        origin_id = self._origin_ids.get(origin)
+        if origin_id is None:
+            origin_id = self._origin_ids[origin] = len(self._origin_table)
+            self._origin_table.append(origin)
+        self._origins.append(origin_id)
+        strings = self._strings
+        string_ids = self._string_ids
+        words = self._words
+        for word in instruction.split(' '):
+            index = string_ids.get(word)
+            if index is None:
+                index = self._temp_number(word)
+                if index is not None:
+                    index |= self._TEMP_FLAG
+                else:
+                    index = string_ids[word] = len(strings)
+                    strings.append(word)
+            words.append(index)
+        if label is not None:
+            self._labels[len(self._starts) - 1] = label
+        self._starts.append(len(words))
+
+    def _temp_number(self, word: str) -> Optional[int]:
+        if not word.startswith(TEMP_PREFIX):
+            return None
+        digits = word[len(TEMP_PREFIX):]
+        # the number must be formatted back to the same text
+        if not (digits.isascii() and digits.isdigit()) or digits[0] == '0' or len(digits) > 9:
+            return None
+        return int(digits)
+
+    def words(self, index: int) -> List[str]:
+        """
+        :return: The opcode and operands of an instruction.
+        """
+        strings = self._strings
+        return [strings[x] if x < self._TEMP_FLAG else f'{TEMP_PREFIX}{x ^ self._TEMP_FLAG}'
+                for x in self._words[self._starts[index]:self._starts[index + 1]]]
+
+    def label(self, index: int) -> Any:
+        return self._labels.get(index)
+
+    def origin(self, index: int) -> Optional[Origin]:
+        return self._origin_table[self._origins[index]]
+
+    def __len__(self) -> int:
+        return len(self._starts) - 1
+
+    def __getitem__(self, index: int) -> Tuple[str, Any]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('instruction index out of range')
+        return ' '.join(self.words(index)), self._labels.get(index)
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+class CodeStream:
+    """
+    Code written out as it is generated, instead of being held until the end.
+    An instruction jumping to a label not placed yet is held back, along with the instructions after it,
+    until the label is placed, so the memory used is bounded by the longest span of pending forward jumps.
+    Supports the operations of `CodeBuffer` used during generation: appending and counting.
+    """
+
+    __slots__ = ('_out', '_count', '_pending', '_origins')
+
+    _out: TextIO
+    _count: int
+    _pending: Deque[Tuple[str, Any]]  # instructions held back, the first one jumps to a label not placed yet
+    _origins: Optional[List[Optional[Origin]]]
+
+    def __init__(self, out: TextIO, origins: Optional[List[Optional[Origin]]] = None):
+        """
+        :param origins: If given, the origin of each instruction is appended to it.
+        """
+        self._out = out
+        self._count = 0
+        self._pending = deque()
+        self._origins = origins
+
+    def append(self, instruction: str, label: Any = None, origin: Optional[Origin] = None):
+        self._count += 1
+        if self._origins is not None:
+            self._origins.append(origin)
+        pending = self._pending
+        if pending:
+            self._flush()
+        if pending or label is not None and label.inst is None:
+            pending.append((instruction, label))
+        else:
+            self._out.write((instruction if label is None else instruction.format(label.inst)) + '\n')
+
+    def close(self):
+        """
+        Write the instructions held back. All labels jumped to must have been placed.
+        """
+        self._flush()
+        if self._pending:
+            raise RuntimeError('A label jumped to is never placed.')
+
+    def _flush(self):
+        pending = self._pending
+        write = self._out.write
+        while pending:
+            instruction, label = pending[0]
+            if label is None:
+                write(instruction + '\n')
+            elif label.inst is not None:
+                write(instruction.format(label.inst) + '\n')
+            else:
+                break
+            pending.popleft()
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class Options:
+    """
+    Switches of optional compiling steps, and the trade-off between size and speed, see `cost.py`.
+    """
+
+    fold_constants: bool  # evaluate constant sub-expressions and simplify identities, see `ir.Program.fold`
+    cse: bool  # compute a value once while its operands are unchanged, see `cse.py`
+    optimize_loops: bool  # hoist invariant operations out of loops and reduce induction variables, see `loops.py`
+    remove_dead_stores: bool  # remove stores to variables never read, see `deadstores.py`
+    reuse_temps: bool  # coalesce copies and share temporaries not alive at the same time, see `regalloc.py`
+    peephole: bool  # thread jumps and remove useless or unreachable instructions, see `peephole.py`
+    inline: bool  # generate the bodies of small functions, or functions called once, at their call sites
+    inline_budget: int  # number of instructions inlining may add to the code, see `ir.Program.plan_inlining`
+    speed_weight: float  # instructions the code may grow by to save one instruction executed on each run
+    max_instructions: int  # size the code must fit in, trading speed for size as needed, 0 for no limit
+    owned_cells: Tuple[str, ...]  # memory cells and banks no other processor writes, whose reads `cse` may reuse
+
+    # `speed_weight` of each optimization level, see `level`
+    LEVELS = {'0': 0.0, '1': 0.0, '2': 4.0, 's': 0.0}
+
+    def __init__(self, fold_constants: bool = True, reuse_temps: bool = True, peephole: bool = True,
+                 inline: bool = True, inline_budget: int = 100, cse: bool = True, optimize_loops: bool = True,
+                 speed_weight: float = LEVELS['2'], max_instructions: int = 0, owned_cells: Tuple[str, ...] = (),
+                 remove_dead_stores: bool = True):
+        self.fold_constants = fold_constants
+        self.cse = cse
+        self.optimize_loops = optimize_loops
+        self.remove_dead_stores = remove_dead_stores
+        self.reuse_temps = reuse_temps
+        self.peephole = peephole
+        self.inline = inline
+        self.inline_budget = inline_budget
+        self.speed_weight = speed_weight
+        self.max_instructions = max_instructions
+        self.owned_cells = owned_cells
+
+    @staticmethod
+    def level(name: str) -> 'Options':
+        """
+        :param name: An optimization level: '0' runs no optimization, '1' only the quick ones making the code
+            both smaller and faster, '2' all of them, trading size for speed, and 's' all of them, making the code
+            as small as possible.
+        """
+        options = Options(speed_weight=Options.LEVELS[name])
+        if name in ('0', '1'):
+            options.cse = options.optimize_loops = False
+        if name == '0':
+            options.fold_constants = options.remove_dead_stores = options.reuse_temps = options.peephole = False
+            options.inline = False
+        return options
+
+    def backed_off(self) -> Optional['Options']:
+        """
+        :return: Options trading less size for speed, or `None` if these already make the code as small
+            as they can.
+        """
+        if self.speed_weight <= 0:
+            return None
+        options = copy.copy(self)
+        options.speed_weight = self.speed_weight / 4 if self.speed_weight > 0.25 else 0.0
+        return options
+
+    def key(self) -> str:
+        """
+        :return: A string identifying these options, e.g. as a part of cache keys.
+        """
+        return ','.join(f'{name}={value}' for name, value in sorted(vars(self).items()))
+
+
+class CompilationUnit:
+    """
+    State of a single compilation: the source being read, the options, the lexer's pending tokens,
+    the parsing context, the code buffer, the counters used to name temporaries and labels,
+    and the origin and loop depth of the code being generated.
+    A unit is only touched by the thread compiling it, so independent units can be compiled concurrently.
+    """
+
+    file: TextIO
+    options: Options
+    tokens: Deque  # element type is lex.Token
+    token_count: int  # number of tokens read so far, not counting the end of file
+    lex_seconds: Optional[float]  # time spent in the lexer so far, if measured
+    line_num: int
+    context: list
+    code: CodeBuffer  # or a `CodeStream`
+    temp_var_num: int
+    last_label: int
+    origin: Optional[Origin]  # attributed to the instructions being generated
+    function: Optional[str]  # name of the function being generated
+    loop_depth: int  # number of loops around the code being generated, within the procedure
+
+    def __init__(self, file: TextIO, options: Optional[Options] = None):
+        self.file = file
+        self.options = options if options is not None else Options()
+        self.tokens = deque()
+        self.token_count = 0
+        self.lex_seconds = None
+        self.line_num = 1
+        self.context = []
+        self.code = CodeBuffer()
+        self.temp_var_num = 0
+        self.last_label = -1
+        self.origin = None
+        self.function = None
+        self.loop_depth = 0
+
+
+class _Local(threading.local):
+    unit: Optional[CompilationUnit] = None
+
+
+_local = _Local()
+
+
+def unit() -> CompilationUnit:
+    """
+    :return: The unit being compiled by the current thread.
+    """
+    current = _local.unit
+    if current is None:
+        raise RuntimeError('No compilation unit is active in this thread.')
+    return current
+
+
+@contextmanager
+def compiling(current: CompilationUnit) -> Iterator[CompilationUnit]:
+    """
+    Make `current` the unit compiled by this thread for the duration of the `with` block.
+    """
+    previous = _local.unit
+    _local.unit = current
+    try:
+        yield current
+    finally:
+        _local.unit = previous
+
+
+class SizeError(Exception):
+    """
+    The code does not fit in `Options.max_instructions`, even as small as the options can make it.
+    """
+
+    def __init__(self, size: int, max_instructions: int):
+        self.message = f'The code takes {size} instructions, more than the maximum of {max_instructions}.'
+        self.size = size
+        self.max_instructions = max_instructions
 
 
 class ParseError(Exception):
@@ -0,0 +1,308 @@
+"""
+Incremental compilation of successive versions of a source, e.g. as it is edited.
+A `FunctionCache` keeps the syntax tree and the generated code of each function, and reuses them as long as
+the text of the function and the functions it depends on are unchanged. Only the changed functions and the main
+procedure are parsed and generated again. Reused code is relocated: its labels, temporaries and source lines
+are moved to where the function lands in the new code. The passes over the whole code still run every time.
+"""
+from collections import deque
+from typing import Dict, List, Tuple, Optional, Union
+
+import g
+import ir
+import lex
+import phases
+import syntax
+from lex import Token, TokenType
+
+# a relocatable instruction: words, indices of words that are temporaries, the target of a jump,
+# and the origin with the line relative to the definition of the function it names
+_Target = Union[int, str, None]  # offset from the start of the body, or the name of a function called
+_Inst = Tuple[List[Union[str, int]], List[int], _Target, Optional[g.Origin]]
+
+
+class _Parsed:
+    """
+    A function parsed from its text.
+    """
+
+    __slots__ = ('text', 'func', 'line', 'arity', 'calls', 'serial')
+
+    text: str
+    func: ir.Function
+    line: int  # line of `def`, to which the positions in the syntax tree belong
+    arity: Dict[str, int]  # number of parameters of each function called, which parsing depends on
+    calls: Dict[str, int]  # number of call sites of each function called
+    serial: int  # distinguishes syntax trees of the same function
+
+    def __init__(self, text: str, func: ir.Function, line: int, arity: Dict[str, int], serial: int):
+        self.text = text
+        self.func = func
+        self.line = line
+        self.arity = arity
+        self.calls = func.calls()
+        self.serial = serial
+
+
+class _Generated:
+    """
+    The code of a function, in relocatable form.
+    """
+
+    __slots__ = ('key', 'insts', 'temps')
+
+    key: tuple  # what the code depends on, see `FunctionCache._key`
+    insts: List[_Inst]
+    temps: int  # number of temporaries named by the code
+
+    def __init__(self, key: tuple, insts: List[_Inst], temps: int):
+        self.key = key
+        self.insts = insts
+        self.temps = temps
+
+
+class FunctionCache:
+    """
+    Syntax trees and code of the functions of the last version of a source compiled, by function name.
+    Use one cache for each source, e.g. with `mindc.compile_incremental`.
+    """
+
+    options: g.Options
+    reused: int  # number of functions whose syntax tree was reused in the last compile
+    _parsed: Dict[str, _Parsed]
+    _generated: Dict[str, _Generated]
+    _sizes: Dict[str, Tuple[tuple, int]]
+    _serial: int
+    _keys: Dict[str, tuple]  # memo of `_key` during a compile
+
+    def __init__(self, options: Optional[g.Options] = None):
+        self.options = options if options is not None else g.Options()
+        self.reused = 0
+        self._parsed = {}
+        self._generated = {}
+        self._sizes = {}
+        self._serial = 0
+        self._keys = {}
+
+    def __len__(self) -> int:
+        """
+        :return: The number of functions in the last version compiled.
+        """
+        return len(self._parsed)
+
+    def generate(self, source: str):
+        """
+        Parse and generate `source` into the code buffer of the current unit, which must read `source`
+        with the options of this cache.
+        The source is read as a whole before parsing, so unlike in a normal compile, an invalid token may be
+        reported before a syntax error preceding it.
+        :raise g.ParseError: If the source code is invalid.
+        """
+        unit = g.unit()
+        self.reused = 0
+        self._keys = {}
+        if phases.observed():
+            unit.lex_seconds = 0.0
+        with phases.phase(phases.PARSE, lambda: {'lex_seconds': unit.lex_seconds, 'tokens': unit.token_count,
+                                                 'nodes': prog.count_nodes()}):
+            prog, fresh = self._parse(source)
+        if unit.options.fold_constants:
+            with phases.phase(phases.FOLD, lambda: {'nodes': prog.count_nodes()}):
+                for func in fresh:  # reused trees are folded already
+                    func.fold()
+                prog.main_procedure = [stmt.fold() for stmt in prog.main_procedure]
+        with phases.phase(phases.GENERATE, lambda: {'instructions': len(unit.code)}):
+            prog.generate(self._measure, self._generate_function)
+        for name in list(self._parsed):
+            if name not in prog.functions:
+                del self._parsed[name]
+                self._generated.pop(name, None)
+                self._sizes.pop(name, None)
+
+    def _parse(self, source: str) -> Tuple[ir.Program, List[ir.Function]]:
+        """
+        :return: The program, and the functions parsed rather than reused.
+        """
+        unit = g.unit()
+        tokens = []
+        while not tokens or tokens[-1].type_ != TokenType.EOF:
+            tokens.append(lex.read())
+        line_starts = [0]
+        for line in source.split('\n'):
+            line_starts.append(line_starts[-1] + len(line) + 1)
+
+        prog = ir.Program()
+        fresh = []
+        start = 0
+        while tokens[start].type_ == TokenType.Def:
+            end = _function_end(tokens, start)
+            name_tk = tokens[start + 1]
+            text = source[line_starts[tokens[start].line - 1] + tokens[start].pos - 1:
+                          line_starts[tokens[end].line - 1] + tokens[end].pos]
+            parsed = self._parsed.get(name_tk.value)
+            if (parsed is not None and parsed.text == text and name_tk.value not in prog.functions
+                    and all(name in prog.functions and len(prog.functions[name].param) == arity
+                            for name, arity in parsed.arity.items())):
+                self._reuse(parsed, prog, tokens[start].line)
+                self.reused += 1
+            else:
+                unit.tokens = deque(tokens[start:end + 1])
+                unit.tokens.append(Token(TokenType.EOF, None, tokens[end].line, tokens[end].pos + 1))
+                unit.context.append(prog)
+                func = syntax.function()
+                unit.context.pop()
+                if lex.peek().type_ != TokenType.EOF:  # the body ends before the matching brace
+                    tk = lex.peek()
+                    raise g.ParseError('Expected "}".', tk.line, tk.pos)
+                self._serial += 1
+                parsed = _Parsed(text, func, tokens[start].line,
+                                 {name: len(prog.functions[name].param) for name in func.calls()}, self._serial)
+                self._parsed[func.name] = parsed
+                fresh.append(func)
+            prog.functions[parsed.func.name] = parsed.func
+            start = end + 1
+
+        unit.tokens = deque(tokens[start:])
+        prog.main_procedure = list(syntax.main_procedure(prog))
+        return prog, fresh
+
+    @staticmethod
+    def _reuse(parsed: _Parsed, prog: ir.Program, line: int):
+        """
+        Prepare the syntax tree of a function for another compile: move it to the line it is defined at,
+        refer to the functions of `prog`, and count its calls as if it was parsed.
+        """
+        func = parsed.func
+        func.call_count = 0
+        func.inline = False
+        func.home_label = ir.Label()
+        delta = line - parsed.line
+        parsed.line = line
+        for node in ir.walk(func.statements):
+            if isinstance(node, ir.FunctionExpr):
+                node.func = prog.functions[node.func.name]
+            elif delta and isinstance(node, ir.Statement) and node.line:
+                node.line += delta
+        for name, count in parsed.calls.items():
+            prog.functions[name].call_count += count
+
+    def _key(self, func: ir.Function) -> tuple:
+        """
+        :return: What the code of a function depends on: its syntax tree, and for each function called,
+            the name, the parameters, whether it is inlined, and if so, what its code depends on.
+        """
+        key = self._keys.get(func.name)
+        if key is None:
+            parsed = self._parsed[func.name]
+            callees = []
+            for name in sorted(parsed.calls):
+                callee = self._parsed[name].func
+                callees.append((name, tuple(callee.param), callee.inline, self._key(callee) if callee.inline else None))
+            key = self._keys[func.name] = (parsed.serial, tuple(callees))
+        return key
+
+    def _measure(self, func: ir.Function) -> int:
+        key = self._key(func)
+        cached = self._sizes.get(func.name)
+        if cached is None or cached[0] != key:
+            cached = self._sizes[func.name] = key, func.size()
+        return cached[1]
+
+    def _generate_function(self, func: ir.Function):
+        unit = g.unit()
+        key = self._key(func)
+        cached = self._generated.get(func.name)
+        if cached is not None and cached.key == key:
+            func.home_label.generate()
+            self._splice(func.name, cached)
+            return
+        start, temp_base = len(unit.code), unit.temp_var_num
+        func.generate()
+        generated = self._capture(func.name, key, start, temp_base)
+        if generated is not None:
+            self._generated[func.name] = generated
+        else:
+            self._generated.pop(func.name, None)
+
+    def _capture(self, name: str, key: tuple, start: int, temp_base: int) -> Optional[_Generated]:
+        """
+        :return: The code generated from `start` in relocatable form, or `None` if it cannot be relocated.
+        """
+        unit = g.unit()
+        code = unit.code
+        end = len(code)
+        homes = {id(parsed.func.home_label): name for name, parsed in self._parsed.items()}
+        insts = []
+        for i in range(start, end):
+            words = code.words(i)
+            temps = []
+            for j, word in enumerate(words):
+                if word.startswith(g.TEMP_PREFIX):
+                    number = word[len(g.TEMP_PREFIX):]
+                    if not number.isdigit() or int(number) <= temp_base:
+                        return None  # named by a raw statement
+                    temps.append(j)
+                    words[j] = int(number) - temp_base
+            label = code.label(i)
+            if label is None:
+                target = None
+            elif start <= label.inst <= end:
+                target = label.inst - start
+            elif id(label) in homes:
+                target = homes[id(label)]
+            else:
+                return None
+            origin = code.origin(i)
+            if origin is not None:
+                line, pos, function = origin
+                origin = line - self._parsed[function or name].line, pos, function
+            insts.append((words, temps, target, origin))
+        return _Generated(key, insts, unit.temp_var_num - temp_base)
+
+    def _splice(self, name: str, generated: _Generated):
+        """
+        Append relocated code of a function to the current unit.
+        """
+        unit = g.unit()
+        code = unit.code
+        start, temp_base = len(code), unit.temp_var_num
+        labels: Dict[int, ir.Label] = {}
+        for words, temps, target, origin in generated.insts:
+            if temps:
+                words = list(words)
+                for j in temps:
+                    words[j] = f'{g.TEMP_PREFIX}{words[j] + temp_base}'
+            if target is None:
+                label = None
+            elif isinstance(target, int):
+                label = labels.get(target)
+                if label is None:
+                    label = labels[target] = ir.Label()
+                    label.inst = start + target
+            else:
+                label = self._parsed[target].func.home_label
+            if origin is not None:
+                line, pos, function = origin
+                origin = line + self._parsed[function or name].line, pos, function
+            code.append(' '.join(words), label, origin)
+        unit.temp_var_num += generated.temps
+        if labels:
+            unit.last_label = max(label.inst for label in labels.values())
+
+
+def _function_end(tokens: List[Token], start: int) -> int:
+    """
+    :return: The index of the brace closing the body of the function defined from `start`.
+    :raise g.ParseError: If the braces are unbalanced.
+    """
+    depth = 0
+    for i in range(start, len(tokens)):
+        type_ = tokens[i].type_
+        if type_ == TokenType.LBrace:
+            depth += 1
+        elif type_ == TokenType.RBrace:
+            depth -= 1
+            if depth == 0:
+                return i
+    tk = tokens[-1]
+    raise g.ParseError('Expected "}".', tk.line, tk.pos)
@@ -1,48 +1,233 @@
+import copy
 from abc import ABC, abstractmethod
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, Iterable, Iterator, Union, Callable
 
+import cost
 import g
+import ops
 
 
 class Program:
+    __slots__ = ('functions', 'main_procedure')
+
     functions: Dict[str, 'Function']
     main_procedure: List['Statement']
 
     def __init__(self):
         self.functions = {}
 
-    def generate(self):
+    def fold(self):
+        """
+        Evaluate constant sub-expressions and simplify algebraic identities throughout the program.
+        """
+        for func in self.functions.values():
+            func.fold()
+        self.main_procedure = [stmt.fold() for stmt in self.main_procedure]
+
+    def count_nodes(self) -> int:
+        """
+        :return: The number of nodes in the syntax tree, including the program and the functions.
+        """
+        return (1 + sum(func.count_nodes() for func in self.functions.values())
+                + sum(stmt.count_nodes() for stmt in self.main_procedure))
+
+    def generate(self, measure: Optional[Callable[['Function'], int]] = None,
+                 generate_function: Optional[Callable[['Function'], None]] = None):
+        """
+        :param measure: Measures the body of a function to plan inlining, `Function.size` by default.
+        :param generate_function: Generates a function not inlined, `Function.generate` by default.
+        """
+        unit = g.unit()
+        if unit.options.inline:
+            self.plan_inlining(unit.options.inline_budget, measure)
         for stmt in self.main_procedure:
             stmt.generate()
-        if self.functions:
+        functions = [func for func in self.functions.values() if not func.inline]
+        if functions:
             _emit('end')
+            for func in functions:
+                if generate_function is None:
+                    func.generate()
+                else:
+                    generate_function(func)
+        if len(unit.code) == unit.last_label:
+            _emit('noop')
+
+    def generate_streaming(self, statements: Iterable['Statement']):
+        """
+        Generate the code in an order suited to writing it out as it is generated: the functions first,
+        behind a jump to the main procedure, so that calls jump back to functions already written.
+        Constants are folded here, one statement at a time.
+        :param statements: The main procedure, which may be parsed as it is iterated. Inlining is planned
+            before generating functions, so with inlining enabled, all of it must have been parsed.
+        """
+        unit = g.unit()
+        fold = unit.options.fold_constants
+        if fold:
             for func in self.functions.values():
+                func.fold()
+        if unit.options.inline:
+            self.plan_inlining(unit.options.inline_budget)
+        functions = [func for func in self.functions.values() if not func.inline]
+        main_label = Label()
+        if functions:
+            _emit('jump {} always', main_label)
+            for func in functions:
                 func.generate()
-        if len(g.code) == Label.last_label:
+        main_label.generate()
+        for stmt in statements:
+            (stmt.fold() if fold else stmt).generate()
+        if len(unit.code) == unit.last_label:
             _emit('noop')
 
+    def plan_inlining(self, budget: int, measure: Optional[Callable[['Function'], int]] = None):
+        """
+        Decide which functions are inlined at all their call sites: those whose inlining does not enlarge the code,
+        e.g. functions called once, and small ones worth it by `cost.worth`, while the total growth stays within
+        `budget` instructions. Each call site is assumed to run once.
+        A function only calls functions defined before it, so the size of each function is measured
+        after deciding on the functions it calls.
+        A function that may return without a value is not inlined where its value is used: a call leaves the value
+        returned by the previous call, which an inlined body does not have.
+        :param measure: Measures the body of a function, `Function.size` by default.
+        """
+        statements = self.main_procedure + [stmt for func in self.functions.values() for stmt in func.statements]
+        discarded = {id(node.value) for node in walk(statements)
+                     if isinstance(node, AssignStmt) and node.target == '_' and node.index is None}
+        used = {node.func.name for node in walk(statements)
+                if isinstance(node, FunctionExpr) and id(node) not in discarded}
+        for func in self.functions.values():
+            if func.call_count == 0 or func.name in used and func.may_return_nothing():
+                continue
+            size = func.size() if measure is None else measure(func)
+            growth = (func.call_count - 1) * size - func.call_count * _CALL_OVERHEAD
+            saved = func.call_count * (_CALL_OVERHEAD + 1)  # each call also runs the return
+            if growth <= 0 or size <= _INLINE_MAX_SIZE and growth <= budget and cost.worth(growth, saved):
+                func.inline = True
+                budget -= max(growth, 0)
+
 
 class Function:
+    __slots__ = ('home_label', 'name', 'param', 'statements', 'call_count', 'inline', 'inline_return')
+
     home_label: 'Label'
     name: str
     param: List[str]
     statements: List['Statement']
+    call_count: int  # number of call sites in the source
+    inline: bool  # whether the body is generated at each call site instead of being called
+    inline_return: Optional[Tuple[str, 'Label']]  # while generating an inlined body, the target and the exit
 
     def __init__(self):
         self.home_label = Label()
         self.param = []
+        self.call_count = 0
+        self.inline = False
+        self.inline_return = None
+
+    def __deepcopy__(self, memo):
+        return self  # copies of statements still call and return from the same function
+
+    def fold(self):
+        self.statements = [stmt.fold() for stmt in self.statements]
+
+    def count_nodes(self) -> int:
+        return 1 + sum(stmt.count_nodes() for stmt in self.statements)
+
+    def calls(self) -> Dict[str, int]:
+        """
+        :return: The number of call sites of each function called in the body, counted the same as `call_count`.
+        """
+        counts = {}
+        for node in walk(self.statements):
+            if isinstance(node, FunctionExpr):
+                counts[node.func.name] = counts.get(node.func.name, 0) + 1
+        return counts
 
     def generate(self):
         self.home_label.generate()
-        for stmt in self.statements:
+        self._generate_body(self.statements)
+
+    def generate_inline(self, target: str):
+        """
+        Generate a copy of the body, whose returns store the value to `target` and jump past the end.
+        The copy has its own labels, so the body can be generated any number of times.
+        """
+        exit_label = Label()
+        self.inline_return = target, exit_label
+        try:
+            self._generate_body(copy.deepcopy(self.statements))
+        finally:
+            self.inline_return = None
+        exit_label.generate()
+
+    def may_return_nothing(self) -> bool:
+        """
+        :return: Whether a return without a value may end a call, including the one added at the end of a body
+            that may run past its last statement.
+        """
+        return any(isinstance(node, ReturnStmt) and node.value is None for node in walk(self.statements))
+
+    def size(self) -> int:
+        """
+        :return: The number of instructions of the body, measured by generating a copy of it aside.
+        """
+        return _measure(lambda: self._generate_body(copy.deepcopy(self.statements)))
+
+    def _generate_body(self, statements: List['Statement']):
+        unit = g.unit()
+        outer = unit.function
+        unit.function = self.name
+        for stmt in statements:
             stmt.generate()
+        unit.function = outer
 
 
 class Statement(ABC):
-    _returns_cache: Optional[bool] = None
+    __slots__ = ('_returns_cache', 'line', 'pos')
+
+    _returns_cache: Optional[bool]
+    line: int  # position of the first token in the source, 0 if not known
+    pos: int
+
+    def __init__(self):
+        self._returns_cache = None
+        self.line = 0
+        self.pos = 0
+
+    def generate(self):
+        """
+        Generate the code of this statement. The instructions are attributed to its position in the source,
+        unless they are attributed to a nested statement.
+        """
+        unit = g.unit()
+        outer = unit.origin
+        if self.line:
+            unit.origin = self.line, self.pos, unit.function
+        self._generate()
+        unit.origin = outer
 
     @abstractmethod
-    def generate(self): pass
+    def _generate(self): pass
+
+    def fold(self) -> 'Statement':
+        """
+        Fold constant expressions in this statement.
+        :return: The simplified statement, which may be `self`.
+        """
+        return self
+
+    def children(self) -> List['Node']:
+        """
+        :return: The statements and expressions directly nested in this statement.
+        """
+        return []
+
+    def count_nodes(self) -> int:
+        """
+        :return: The number of nodes in the subtree of this statement, including expressions.
+        """
+        return 1 + sum(child.count_nodes() for child in self.children())
 
     def returns(self) -> bool:
         if self._returns_cache is None:
@@ -54,11 +239,17 @@ class Statement(ABC):
 
 
 class AssignStmt(Statement):
+    __slots__ = ('target', 'index', 'value')
+
     target: str
-    index: Optional['Expression'] = None
+    index: Optional['Expression']
     value: 'Expression'
 
-    def generate(self):
+    def __init__(self):
+        super().__init__()
+        self.index = None
+
+    def _generate(self):
         if self.index is None:
             self.value.generate_to(self.target)
         else:
@@ -66,14 +257,38 @@ class AssignStmt(Statement):
             index_var = self.index.generate()
             _emit(f'write {value_var} {self.target} {index_var}')
 
+    def fold(self) -> Statement:
+        self.value = self.value.fold()
+        if self.index is not None:
+            self.index = self.index.fold()
+        return self
+
+    def children(self) -> List['Node']:
+        return [self.value] if self.index is None else [self.value, self.index]
+
 
 class CondStmt(Statement):
+    """
+    An `if` statement. A chain of `if`s and `else if`s comparing a variable to integers, like the states of a state
+    machine, dispatches through a jump table if it is dense, and worth the size of the table by `cost.worth`
+    for the instructions it saves on average.
+    """
+
+    __slots__ = ('condition', 'match', 'mismatch')
+
     condition: 'Expression'
     match: Statement
-    mismatch: Optional[Statement] = None
+    mismatch: Optional[Statement]
 
-    def generate(self):
-        if self.mismatch is not None:
+    def __init__(self):
+        super().__init__()
+        self.mismatch = None
+
+    def _generate(self):
+        cases = self._cases()
+        if cases is not None:
+            self._generate_table(*cases)
+        elif self.mismatch is not None:
             mismatch_label = Label()
             end_label = Label()
             self.condition.generate_condition(mismatch_label, invert=True)
@@ -88,77 +303,259 @@ class CondStmt(Statement):
             self.match.generate()
             end_label.generate()
 
+    def _cases(self) -> Optional[Tuple[str, Dict[int, Statement], Optional[Statement]]]:
+        """
+        :return: If this is a chain of comparisons worth a jump table: the variable compared, the statement run
+            for each integer, in order, and the statement run if none matches. Otherwise `None`.
+        """
+        var = None
+        cases = {}
+        stmt = self
+        while isinstance(stmt, CondStmt):
+            condition = stmt.condition
+            if not isinstance(condition, OperationExpr) or condition.inst != 'equal':
+                break
+            operand, value = condition.opr1, condition.opr2.constant()
+            if value is None:
+                operand, value = condition.opr2, condition.opr1.constant()
+            # built-in variables may change between comparisons
+            if (value is None or value != int(value) or not isinstance(operand, BaseExpr)
+                    or operand.constant() is not None or operand.value.startswith('@')
+                    or var is not None and operand.value != var):
+                break
+            var = operand.value
+            cases.setdefault(int(value), stmt.match)  # a later comparison to the same value never matches
+            stmt = stmt.mismatch
+        if not cases:
+            return None
+        low, high = min(cases), max(cases)
+        if high - low + 1 > _TABLE_MAX_SPREAD * len(cases):
+            return None
+        # The k-th comparison runs after k - 1 others, so on average half of them run. The table takes
+        # the instructions of the dispatch, except the jump of the entry, and an entry for each integer.
+        dispatch = _TABLE_DISPATCH + (low != 0)
+        size = dispatch - 1 + high - low + 1 - len(cases)
+        if not cost.worth(size, ((len(cases) + 1) / 2 - dispatch) * cost.frequency(g.unit().loop_depth)):
+            return None
+        return var, cases, stmt
+
+    def _generate_table(self, var: str, cases: Dict[int, Statement], default: Optional[Statement]):
+        """
+        Round the variable to an integer, which must be the variable itself within the range of the table,
+        and add its offset in the table to `@counter`, jumping to the entry for it.
+        The label placed after the table marks the addition of the offset, see `cfg.load`.
+        """
+        low, high = min(cases), max(cases)
+        end_label = Label()
+        default_label = Label() if default is not None else end_label
+        labels = {value: Label() for value in cases}
+        index = _get_next_temp()
+        _emit(f'op add {index} {var} 0.5')
+        _emit(f'op floor {index} {index} 0')
+        _emit(f'jump {{}} notEqual {index} {var}', default_label)
+        _emit(f'jump {{}} lessThan {index} {low}', default_label)
+        _emit(f'jump {{}} greaterThan {index} {high}', default_label)
+        if low != 0:
+            _emit(f'op sub {index} {index} {low}')
+        table_end = Label()
+        _emit(f'op add @counter @counter {index}', table_end)
+        for value in range(low, high + 1):
+            _emit('jump {} always', labels.get(value, default_label))
+        table_end.generate()
+        last = next(reversed(cases))
+        for value, stmt in cases.items():
+            labels[value].generate()
+            stmt.generate()
+            if value != last or default is not None:
+                _emit('jump {} always', end_label)
+        if default is not None:
+            default_label.generate()
+            default.generate()
+        end_label.generate()
+
+    def fold(self) -> Statement:
+        self.condition = self.condition.fold()
+        value = self.condition.constant()
+        if value is not None:
+            branch = self.match if value != 0 else self.mismatch
+            return branch.fold() if branch is not None else EmptyStmt()
+        self.match = self.match.fold()
+        if self.mismatch is not None:
+            self.mismatch = self.mismatch.fold()
+        return self
+
+    def children(self) -> List['Node']:
+        return [self.condition, self.match] + ([self.mismatch] if self.mismatch is not None else [])
+
     def _returns(self) -> bool:
         return self.mismatch and self.match.returns() and self.mismatch.returns()
 
 
 class LoopStmt(Statement):
-    home_label: 'Label'
+    """
+    A `while` loop, generated with the condition tested at the bottom, so each iteration runs a single jump.
+    The loop is entered through a copy of the condition in front of it, which saves a jump and leaves room to move
+    code out of the loop, if it is worth the size of the condition by `cost.worth`. Otherwise, or if the condition
+    calls a function, which copying would call from one more site, it is entered by a jump to the test.
+    """
+
+    __slots__ = ('home_label', 'end_label', 'condition', 'body')
+
+    home_label: 'Label'  # the test of the condition, where `continue` jumps to
     end_label: 'Label'
     condition: 'Expression'
     body: Statement
 
     def __init__(self):
+        super().__init__()
         self.home_label = Label()
         self.end_label = Label()
 
-    def generate(self):
+    def _generate(self):
+        unit = g.unit()
+        body_label = Label()
+        if (any(isinstance(node, FunctionExpr) for node in walk([self.condition]))
+                or not cost.worth(_measure(lambda: self.condition.generate_condition(self.end_label, True)) - 1,
+                                  cost.frequency(unit.loop_depth))):
+            _emit('jump {} always', self.home_label)
+        else:
+            self.condition.generate_condition(self.end_label, invert=True)
+        body_label.generate()
+        unit.loop_depth += 1
+        self.body.generate()
+        unit.loop_depth -= 1
         self.home_label.generate()
-        self.condition.generate_condition(self.end_label, invert=True)
+        self.condition.generate_condition(body_label, invert=False)
+        self.end_label.generate()
+
+    def fold(self) -> Statement:
+        self.condition = self.condition.fold()
+        if self.condition.constant() == 0:
+            return EmptyStmt()
+        self.body = self.body.fold()
+        return self
+
+    def children(self) -> List['Node']:
+        return [self.condition, self.body]
+
+
+class DoLoopStmt(LoopStmt):
+    """
+    A `do ... while` loop, whose body runs once before the condition is tested.
+    """
+
+    __slots__ = ()
+
+    def _generate(self):
+        unit = g.unit()
+        body_label = Label()
+        body_label.generate()
+        unit.loop_depth += 1
         self.body.generate()
-        _emit('jump {} always', self.home_label)
+        unit.loop_depth -= 1
+        self.home_label.generate()
+        self.condition.generate_condition(body_label, invert=False)
         self.end_label.generate()
 
+    def fold(self) -> Statement:
+        self.condition = self.condition.fold()
+        self.body = self.body.fold()
+        return self
+
 
 class ReturnStmt(Statement):
-    value: Optional['Expression'] = None
+    __slots__ = ('value', 'belong_func')
+
+    value: Optional['Expression']
     belong_func: Function
 
-    def generate(self):
+    def __init__(self):
+        super().__init__()
+        self.value = None
+
+    def _generate(self):
         name = self.belong_func.name
+        if self.belong_func.inline_return is not None:
+            target, exit_label = self.belong_func.inline_return
+            if self.value is None:
+                if target != '_':
+                    _emit(f'set {target} $ret${name}')
+            elif target != '_' or not self.value.is_pure():
+                self.value.generate_to(target)
+            _emit('jump {} always', exit_label)
+            return
         if self.value is not None:
             self.value.generate_to(f'$ret${name}')
         _emit(f'set @counter $ra${name}')
 
+    def fold(self) -> Statement:
+        if self.value is not None:
+            self.value = self.value.fold()
+        return self
+
+    def children(self) -> List['Node']:
+        return [self.value] if self.value is not None else []
+
     def _returns(self) -> bool:
         return True
 
 
 class JumpStmt(Statement):
+    __slots__ = ('target',)
+
     target: 'Label'
 
-    def generate(self):
+    def _generate(self):
         _emit('jump {} always', self.target)
 
 
 class RawStmt(Statement):
+    __slots__ = ('inst',)
+
     inst: str
 
-    def generate(self):
+    def _generate(self):
         _emit(self.inst)
 
 
 class CompoundStmt(Statement):
+    __slots__ = ('stmts',)
+
     stmts: List[Statement]
 
-    def generate(self):
+    def _generate(self):
         for stmt in self.stmts:
             stmt.generate()
 
+    def fold(self) -> Statement:
+        self.stmts = [stmt.fold() for stmt in self.stmts]
+        return self
+
+    def children(self) -> List['Node']:
+        return self.stmts
+
     def _returns(self) -> bool:
         return any(x.returns() for x in self.stmts)
 
 
 class EmptyStmt(Statement):
-    def generate(self):
+    __slots__ = ()
+
+    def _generate(self):
         pass
 
 
 class Expression(ABC):
+    __slots__ = ('type_is_bool', 'value_is_bool')
+
     # not all bool expressions must be converted to 0/1 immediately, e.g. operands of logical operators.
     # the next two fields attempt to convert them as needed.
-    type_is_bool: bool = False  # whether this expr is expected to return a bool value
-    value_is_bool: bool = False  # whether this expr actually returns a bool value
+    type_is_bool: bool  # whether this expr is expected to return a bool value
+    value_is_bool: bool  # whether this expr actually returns a bool value
+
+    def __init__(self):
+        self.type_is_bool = False
+        self.value_is_bool = False
 
     def convert_to_bool(self) -> 'Expression':
         """
@@ -167,7 +564,7 @@ class Expression(ABC):
         :return: The new expression if converted, otherwise `self`.
         """
         if self.type_is_bool and not self.value_is_bool:
-            exp = OperationExpr('not', self, BaseExpr.zero(), True, convert_operand=False)
+            exp = OperationExpr('notEqual', self, BaseExpr.zero(), True, convert_operand=False)
             exp.value_is_bool = True
             return exp
         else:
@@ -186,28 +583,68 @@ class Expression(ABC):
         cond = 'equal' if invert else 'notEqual'
         _emit(f'jump {{}} {cond} {var} 0', label)
 
+    def fold(self) -> 'Expression':
+        """
+        Evaluate constant sub-expressions and simplify algebraic identities.
+        Operands are assumed to be numbers, e.g. `x + 0` is simplified to `x` even if `x` may hold an object.
+        :return: The simplified expression, which may be `self`.
+        """
+        return self
+
+    def constant(self) -> Optional[float]:
+        """
+        :return: The value if this expression is a number literal, otherwise `None`.
+        """
+        return None
+
+    def children(self) -> List['Expression']:
+        """
+        :return: The operands of this expression.
+        """
+        return []
+
+    def count_nodes(self) -> int:
+        """
+        :return: The number of nodes in the subtree of this expression.
+        """
+        return 1 + sum(child.count_nodes() for child in self.children())
+
+    def is_pure(self) -> bool:
+        """
+        :return: Whether evaluating this expression has no side effects, so it can be skipped or reordered.
+        """
+        return True
+
 
 class BaseExpr(Expression):
+    __slots__ = ('value',)
+
     value: str
 
     @staticmethod
-    def zero():
-        exp = BaseExpr('0')
-        exp.type_is_bool = True
-        exp.value_is_bool = True
-        return exp
+    def zero() -> 'BaseExpr':
+        """
+        :return: The constant 0, which is also a bool value. The object is shared, and must not be modified.
+        """
+        return _zero
 
     def __init__(self, val: str):
+        super().__init__()
         self.value = val
 
     def generate(self) -> str:
         return self.value
 
+    def constant(self) -> Optional[float]:
+        return ops.parse_number(self.value)
+
     def generate_to(self, target: str):
         _emit(f'set {target} {self.value}')
 
 
 class OperationExpr(Expression):
+    __slots__ = ('inst', 'opr1', 'opr2')
+
     inst: str
     opr1: Expression
     opr2: Expression
@@ -223,6 +660,7 @@ class OperationExpr(Expression):
                          If given `None`, the new expr returns a bool value iff both operands return bool values.
         :param convert_operand: Whether the operands should be converted if their types are bool but values are not.
         """
+        super().__init__()
         if convert_operand:
             opr1 = opr1.convert_to_bool()
             opr2 = opr2.convert_to_bool()
@@ -240,6 +678,36 @@ class OperationExpr(Expression):
         if target != '_':
             _emit(f'op {self.inst} {target} {var1} {var2}')
 
+    def fold(self) -> Expression:
+        self.opr1 = self.opr1.fold()
+        self.opr2 = self.opr2.fold()
+        a = self.opr1.constant()
+        b = self.opr2.constant()
+
+        if a is not None and b is not None and self.inst in _foldable_operations:
+            text = ops.format_number(ops.OPERATIONS[self.inst](a, b))
+            if text is not None:  # otherwise the result is null, or cannot be written as a literal
+                exp = BaseExpr(text)
+                exp.type_is_bool = self.type_is_bool
+                exp.value_is_bool = text in ('0', '1')
+                return exp
+
+        inst = self.inst
+        if inst == 'add' and b == 0 or inst == 'sub' and b == 0 or inst in ('mul', 'div', 'pow') and b == 1:
+            return self.opr1
+        if inst == 'add' and a == 0 or inst == 'mul' and a == 1:
+            return self.opr2
+        # the other operand is dropped, so it must not have side effects
+        if inst == 'mul' and (a == 0 and self.opr2.is_pure() or b == 0 and self.opr1.is_pure()):
+            return BaseExpr.zero()
+        return self
+
+    def is_pure(self) -> bool:
+        return self.opr1.is_pure() and self.opr2.is_pure()
+
+    def children(self) -> List[Expression]:
+        return [self.opr1, self.opr2]
+
     def generate_condition(self, label: 'Label', invert: bool):
         invert_map = {
             'equal': 'notEqual',
@@ -250,7 +718,9 @@ class OperationExpr(Expression):
             'greaterThanEq': 'lessThan'
         }
 
-        if self.inst in invert_map:  # comparison
+        if self.inst in ('equal', 'notEqual') and isinstance(self.opr1, LogicalExpr) and self.opr2.constant() == 0:
+            self.opr1.generate_condition(label, invert != (self.inst == 'equal'))
+        elif self.inst in invert_map:  # comparison
             var1 = self.opr1.generate()
             var2 = self.opr2.generate()
             cond = invert_map[self.inst] if invert else self.inst
@@ -259,11 +729,90 @@ class OperationExpr(Expression):
             super().generate_condition(label, invert)
 
 
+class LogicalExpr(Expression):
+    """
+    Logical and/or with shortcut: the second operand is not evaluated if the first one determines the result.
+    """
+
+    __slots__ = ('inst', 'opr1', 'opr2')
+
+    inst: str  # 'and' or 'or'
+    opr1: Expression
+    opr2: Expression
+
+    def __init__(self, inst: str, opr1: Expression, opr2: Expression):
+        super().__init__()
+        self.inst = inst
+        self.opr1 = opr1
+        self.opr2 = opr2
+        self.type_is_bool = True
+        self.value_is_bool = True  # the value is always generated as 0/1
+
+    def generate_to(self, target: str):
+        if self.opr2.is_pure():
+            # evaluating both operands is cheaper than jumping around
+            if self.inst == 'and':
+                var1 = self.opr1.generate()
+                var2 = self.opr2.generate()
+            else:  # bitwise or is only correct for 0/1
+                var1 = _as_bool(self.opr1).generate()
+                var2 = _as_bool(self.opr2).generate()
+            if target != '_':
+                _emit(f'op {"land" if self.inst == "and" else "or"} {target} {var1} {var2}')
+        else:
+            false_label = Label()
+            end_label = Label()
+            self.generate_condition(false_label, invert=True)
+            if target != '_':
+                _emit(f'set {target} 1')
+                _emit('jump {} always', end_label)
+                false_label.generate()
+                _emit(f'set {target} 0')
+            else:
+                false_label.generate()
+            end_label.generate()
+
+    def generate_condition(self, label: 'Label', invert: bool):
+        if (self.inst == 'and') == invert:
+            # either operand alone can decide to jump: `!(a && b)` is `!a || !b`, and `a || b` is itself
+            self.opr1.generate_condition(label, invert)
+            self.opr2.generate_condition(label, invert)
+        else:
+            # both operands are needed to decide to jump, so skip the second one if the first one decides not to
+            skip_label = Label()
+            self.opr1.generate_condition(skip_label, not invert)
+            self.opr2.generate_condition(label, invert)
+            skip_label.generate()
+
+    def fold(self) -> Expression:
+        self.opr1 = self.opr1.fold()
+        self.opr2 = self.opr2.fold()
+        a = self.opr1.constant()
+        if a is None:
+            return self
+        if (a != 0) == (self.inst == 'or'):  # decided by the first operand
+            return _bool_constant(a != 0)
+        # otherwise the result is the second operand as a bool
+        b = self.opr2.constant()
+        if b is not None:
+            return _bool_constant(b != 0)
+        return _as_bool(self.opr2)
+
+    def is_pure(self) -> bool:
+        return self.opr1.is_pure() and self.opr2.is_pure()
+
+    def children(self) -> List[Expression]:
+        return [self.opr1, self.opr2]
+
+
 class FunctionExpr(Expression):
+    __slots__ = ('func', 'args')
+
     func: Function
     args: List[Expression]
 
     def __init__(self, func: Function, args: List[Expression]):
+        super().__init__()
         self.func = func
         self.args = args
 
@@ -274,17 +823,33 @@ class FunctionExpr(Expression):
             tmp_vars.append(var)
         for param_name, var in zip(self.func.param, tmp_vars):
             _emit(f'set {param_name} {var}')
+        if self.func.inline:
+            self.func.generate_inline(target)
+            return
         _emit(f'op add $ra${self.func.name} @counter 1')
         _emit('jump {} always', self.func.home_label)
         if target != '_':
             _emit(f'set {target} $ret${self.func.name}')
 
+    def fold(self) -> Expression:
+        self.args = [arg.fold() for arg in self.args]
+        return self
+
+    def children(self) -> List[Expression]:
+        return self.args
+
+    def is_pure(self) -> bool:
+        return False
+
 
 class MemoryLoadExpr(Expression):
+    __slots__ = ('cell', 'index')
+
     cell: str
     index: Expression
 
     def __init__(self, cell: str, index: Expression):
+        super().__init__()
         self.cell = cell
         self.index = index
 
@@ -293,24 +858,102 @@ class MemoryLoadExpr(Expression):
         if target != '_':
             _emit(f'read {target} {self.cell} {var}')
 
+    def fold(self) -> Expression:
+        self.index = self.index.fold()
+        return self
+
+    def children(self) -> List[Expression]:
+        return [self.index]
+
+    def is_pure(self) -> bool:
+        return self.index.is_pure()
+
 
 class Label:
-    inst: int
-    last_label: int = -1
+    __slots__ = ('inst',)
+
+    inst: Optional[int]  # index of the instruction labeled, `None` until placed
+
+    def __init__(self):
+        self.inst = None
 
     def generate(self):
-        self.inst = len(g.code)
-        Label.last_label = self.inst
+        unit = g.unit()
+        self.inst = len(unit.code)
+        unit.last_label = self.inst
+
+
+# instructions saved by inlining a call: `op add $ra$f @counter 1`, `jump`, and `set target $ret$f`
+_CALL_OVERHEAD = 3
+# functions larger than this are only inlined if that does not enlarge the code
+_INLINE_MAX_SIZE = 12
+# instructions run to dispatch through a jump table starting at 0: rounding the value, comparing it to the rounded
+# value and to the bounds of the table, adding it to `@counter`, and the jump of the entry
+_TABLE_DISPATCH = 7
+# a jump table has at most this many entries per case, the others jumping to where no case matches
+_TABLE_MAX_SPREAD = 2
+
+# the game may compute these with a different precision
+_foldable_operations = set(ops.OPERATIONS) - {'atan2', 'dst', 'sin', 'cos', 'tan'}
+
+_zero = BaseExpr('0')
+_zero.type_is_bool = True
+_zero.value_is_bool = True
+
+
+Node = Union[Statement, Expression]
+
+
+def walk(nodes: Iterable[Node]) -> Iterator[Node]:
+    """
+    :return: The nodes and all nodes nested in them, parents before children.
+    """
+    stack = list(nodes)
+    stack.reverse()
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.children()))
+
+
+def _measure(generate: Callable[[], None]) -> int:
+    """
+    :return: The number of instructions `generate` emits, measured by generating them aside.
+    """
+    unit = g.unit()
+    code, temp_var_num, last_label = unit.code, unit.temp_var_num, unit.last_label
+    unit.code = g.CodeBuffer()
+    try:
+        generate()
+        return len(unit.code)
+    finally:
+        unit.code, unit.temp_var_num, unit.last_label = code, temp_var_num, last_label
+
+
+def _as_bool(exp: Expression) -> Expression:
+    """
+    :return: An expression evaluating to 1 if `exp` is nonzero, otherwise 0.
+    """
+    if exp.value_is_bool:
+        return exp
+    exp = OperationExpr('notEqual', exp, BaseExpr.zero(), True, convert_operand=False)
+    exp.type_is_bool = True
+    return exp
 
 
-_temp_var_num = 0
+def _bool_constant(value: bool) -> BaseExpr:
+    exp = BaseExpr('1' if value else '0')
+    exp.type_is_bool = True
+    exp.value_is_bool = True
+    return exp
 
 
 def _get_next_temp() -> str:
-    global _temp_var_num
-    _temp_var_num += 1
-    return f'$tmp${_temp_var_num}'
+    unit = g.unit()
+    unit.temp_var_num += 1
+    return f'{g.TEMP_PREFIX}{unit.temp_var_num}'
 
 
 def _emit(instruction: str, label: Label = None):
-    g.code.append((instruction, label))
+    unit = g.unit()
+    unit.code.append(instruction, label, unit.origin)
@@ -1,6 +1,8 @@
+import re
+import time
 from dataclasses import dataclass
 from enum import Enum, auto, unique
-from typing import Optional, List
+from typing import Optional
 
 import g
 
@@ -16,6 +18,7 @@ class TokenType(Enum):
     If = 'if'
     Else = 'else'
     While = 'while'
+    Do = 'do'
     Break = 'break'
     Continue = 'continue'
     Return = 'return'
@@ -56,6 +59,8 @@ class TokenType(Enum):
 
 @dataclass
 class Token:
+    __slots__ = ('type_', 'value', 'line', 'pos')
+
     type_: TokenType
     value: Optional[str]
     line: int
@@ -65,73 +70,73 @@ class Token:
 _operators = {v.value: v for v in TokenType if isinstance(v.value, str) and not v.value.isalpha()}
 _keywords = {v.value: v for v in TokenType if isinstance(v.value, str) and v.value.isalpha()}
 
-_tokens: List[Token] = []
-_line_num: int = 1
-
 
 def peek() -> Token:
-    _fill_tokens()
-    return _tokens[0]
+    tokens = g.unit().tokens
+    if not tokens:
+        _fill_tokens()
+    return tokens[0]
 
 
 def read() -> Token:
-    _fill_tokens()
-    return _tokens.pop(0)
+    tokens = g.unit().tokens
+    if not tokens:
+        _fill_tokens()
+    return tokens.popleft()
 
 
 def _fill_tokens():
-    global _line_num
-
-    while not _tokens:
-        line = g.file.readline()
+    unit = g.unit()
+    if unit.lex_seconds is None:
+        _read_tokens(unit)
+    else:
+        start = time.perf_counter()
+        _read_tokens(unit)
+        unit.lex_seconds += time.perf_counter() - start
+
+
+def _read_tokens(unit: g.CompilationUnit):
+    while not unit.tokens:
+        line = unit.file.readline()
         if line:
             _tokenize_line(line)
-            _line_num += 1
+            unit.token_count += len(unit.tokens)
+            unit.line_num += 1
         else:
-            _add_token(TokenType.EOF, None, 0)
+            unit.tokens.append(Token(TokenType.EOF, None, unit.line_num, 1))
 
 
 def _tokenize_line(line: str):
-    line += ' '  # help peeking
-    i = 0
-    while True:
-        while i < len(line) and line[i].isspace():
-            i += 1
-        if i == len(line):
-            break
-        if line[i:i + 2] in _operators:
-            _add_token(_operators[line[i:i + 2]], None, i)
-            i += 2
-        elif line[i] in _operators:
-            _add_token(_operators[line[i]], None, i)
-            i += 1
-        elif line[i].isdigit() or line[i] == '.':
-            start = i
-            accept_point = True
-            while line[i].isdigit() or (accept_point and line[i] == '.'):
-                if line[i] == '.':
-                    accept_point = False
-                i += 1
-            _add_token(TokenType.Number, line[start:i], start)
-        elif line[i].isalpha() or line[i] == '_' or line[i] == '@':
-            start = i
-            i += 1
-            while line[i].isalnum() or line[i] == '_':
-                i += 1
-            keyword_type = _keywords.get(line[start:i])
-            if keyword_type is not None:
-                _add_token(keyword_type, None, start)
+    unit = g.unit()
+    append = unit.tokens.append
+    line_num = unit.line_num
+    # trailing whitespaces are stripped, since every match consumes the whitespaces before a token
+    for m in _token_regex.finditer(line.rstrip()):
+        kind = m.lastgroup
+        if kind == 'Word':
+            word = m.group(kind)
+            keyword_type = _keywords.get(word)
+            if keyword_type is None:
+                append(Token(TokenType.Identifier, word, line_num, m.start(kind) + 1))
             else:
-                _add_token(TokenType.Identifier, line[start:i], start)
-        elif line[i] == '$':
-            _add_token(TokenType.RawStmt, line[i + 1:].strip(), i)
-            break
-        elif line[i] == '#':
-            break
-        else:
-            raise g.ParseError('Invalid token', _line_num, i + 1)
-
-
-# `index` is 0-based
-def _add_token(type_: TokenType, value: Optional[str], index: int):
-    _tokens.append(Token(type_, value, _line_num, index + 1))
+                append(Token(keyword_type, None, line_num, m.start(kind) + 1))
+        elif kind == 'Operator':
+            append(Token(_operators[m.group(kind)], None, line_num, m.start(kind) + 1))
+        elif kind == 'Number':
+            append(Token(TokenType.Number, m.group(kind), line_num, m.start(kind) + 1))
+        elif kind == 'RawStmt':
+            append(Token(TokenType.RawStmt, m.group(kind).strip(), line_num, m.start(kind)))  # position of `$`
+        elif kind == 'Invalid':
+            raise g.ParseError('Invalid token', line_num, m.start(kind) + 1)
+        # comments are skipped
+
+
+# alternatives are ordered by frequency, except that longer operators must precede their prefixes
+_token_regex = re.compile(r'\s*(?:' + '|'.join([
+    r'(?P<Word>[^\W\d]\w*|@\w*)',
+    '(?P<Operator>' + '|'.join(re.escape(x) for x in sorted(_operators, key=len, reverse=True)) + ')',
+    r'(?P<Number>\d+(?:\.\d*)?|\.\d*)',
+    r'\$(?P<RawStmt>.*)',
+    r'(?P<Comment>#.*)',
+    r'(?P<Invalid>.)'
+]) + ')', re.DOTALL)
@@ -0,0 +1,262 @@
+"""
+Optimization of loops in generated code. A loop is the code from the target of backward jumps up to the last
+of them, entered only at its start, as generated for `while` statements.
+Operations computing the same value on every iteration are hoisted in front of the loop, so they run once.
+An induction variable is one the loop only changes by adding or subtracting integers, like `i = i + 1`.
+A chain of operations computing a linear function of it with an integer factor, like `i * 4 + base`, is replaced
+by a temporary holding the function, set in front of the loop and updated with each change of the induction variable,
+when this is worth the instructions it adds to the code by `cost.worth`. As every instruction takes the same time
+on a processor, a multiplication alone is not worth replacing by an addition.
+Only the factor and the increments are checked to be integers: this assumes the value of the induction variable
+entering the loop and the other operands of the chain are integers as well, as counters and indices are,
+since the temporary would otherwise round differently from the chain.
+Loops containing function calls are left alone, as functions may write any variable.
+"""
+from typing import List, Dict, Set, Tuple, Optional
+
+import cost
+import ops
+from cfg import Inst, is_temp, has_opaque_control_flow
+
+# a linear function of an induction variable: the variable, its factor, and the invariant terms added (`True`)
+# or subtracted (`False`)
+_Linear = Tuple[str, float, Tuple[Tuple[bool, str], ...]]
+
+_MAX_EXACT = 2 ** 53  # integers below this magnitude, and their sums and products below it, are exact as floats
+
+
+def optimize(insts: List[Inst]) -> List[Inst]:
+    """
+    :param insts: The generated code.
+    :return: The code with loops optimized, inner loops first.
+    """
+    if has_opaque_control_flow(insts):
+        return insts
+    if any(not inst.is_known() and any(is_temp(w) for w in inst.words) for inst in insts):
+        return insts  # a raw statement refers to a temporary by name
+    writes: Dict[str, int] = {}
+    reads: Dict[str, int] = {}
+    for inst in insts:
+        dest = inst.writes()
+        if dest is not None and is_temp(dest):
+            writes[dest] = writes.get(dest, 0) + 1
+        for word in inst.reads():
+            if is_temp(word):
+                reads[word] = reads.get(word, 0) + 1
+    single = {temp for temp, count in writes.items() if count == 1}
+    ends: Dict[int, int] = {}  # start of each loop -> its last backward jump, e.g. of `continue` before it
+    for i, inst in enumerate(insts):
+        if inst.target is not None and inst.target <= i and not inst.is_call(insts[i - 1]):
+            ends[inst.target] = i
+    depth: Dict[int, int] = {}  # number of loops each loop is in, counting itself
+    around: List[int] = []  # ends of the loops around the loop
+    for start, end in sorted(ends.items()):
+        while around and around[-1] < start:
+            around.pop()
+        around.append(end)
+        depth[id(insts[end])] = len(around)
+    back_jumps = [insts[end] for start, end in sorted(ends.items(), key=lambda loop: loop[1] - loop[0])]
+    index = {id(inst): i for i, inst in enumerate(insts)}
+    for jump in back_jumps:
+        end = index[id(jump)]
+        optimized = _optimize_loop(insts, jump.target, end, depth[id(jump)], single, reads)
+        if optimized is not None:
+            insts = optimized
+            index = {id(inst): i for i, inst in enumerate(insts)}
+    return insts
+
+
+def _optimize_loop(insts: List[Inst], start: int, end: int, depth: int, single: Set[str],
+                   reads: Dict[str, int]) -> Optional[List[Inst]]:
+    """
+    :param start: Index of the first instruction of the loop.
+    :param end: Index of the last jump back to `start`.
+    :param depth: Number of loops the loop is in, counting itself.
+    :param single: Temporaries written once in the whole code, updated as the code changes.
+    :param reads: Number of reads of each temporary in the whole code, updated as the code changes.
+    :return: The changed code, or `None` if the loop is left alone.
+    """
+    written: Set[str] = set()
+    for i in range(start, end + 1):
+        if i > 0 and insts[i].is_call(insts[i - 1]):
+            return None
+        written.update(insts[i].may_write())
+
+    hoisted = _invariants(insts, start, end, written, single)
+    written.difference_update(insts[i].writes() for i in hoisted)
+    reductions = _reductions(insts, start, end, depth, written, single, reads)
+    if not hoisted and not reductions:
+        return None
+    for i, inst in enumerate(insts):
+        if not start <= i <= end and any(start < target <= end for target in inst.targets()):
+            return None  # entered in the middle
+
+    header = [insts[i] for i in hoisted]
+    removed = set(hoisted)
+    after: Dict[int, List[Inst]] = {}
+    for temp, (var, factor, terms), chain in reductions:
+        origin = insts[chain[-1]].origin
+        header.append(Inst(['op', 'mul', temp, var, ops.format_number(factor)] if factor != 1 else
+                           ['set', temp, var], None, origin))
+        header.extend(Inst(['op', 'add' if plus else 'sub', temp, temp, term], None, origin) for plus, term in terms)
+        for i in range(start, end + 1):
+            w = insts[i].words
+            if insts[i].writes() == var:
+                step = ops.parse_number(w[4]) * factor * (1 if w[1] == 'add' else -1)
+                after.setdefault(i, []).append(Inst(['op', 'add', temp, temp, ops.format_number(step)], None, origin))
+        removed.update(chain)
+        single.discard(temp)
+        for inst in header[-len(terms) - 1:]:
+            for word in inst.reads():
+                if is_temp(word):
+                    reads[word] = reads.get(word, 0) + 1
+        for i in chain:
+            for word in insts[i].reads():
+                if is_temp(word):
+                    reads[word] -= 1
+
+    result = insts[:start] + header
+    new_index = []  # of instructions from `start`
+    for i in range(start, len(insts)):
+        new_index.append(len(result))
+        if i not in removed:
+            result.append(insts[i])
+        result.extend(after.get(i, ()))
+    new_index.append(len(result))
+
+    def moved(i: int, target: int) -> int:
+        # jumps to the loop from outside run the code put in front of it, while those within the loop do not
+        if target > start or target == start and start <= i <= end:
+            return new_index[target - start]
+        return target
+
+    for i, inst in enumerate(insts):
+        if inst.target is not None:
+            inst.target = moved(i, inst.target)
+        elif inst.table is not None:
+            inst.table = [moved(i, target) for target in inst.table]
+    return result
+
+
+def _invariants(insts: List[Inst], start: int, end: int, written: Set[str], single: Set[str]) -> List[int]:
+    """
+    :return: Indices of the operations and copies in the loop computing the same value on every iteration,
+        into temporaries not read in the loop before, in order.
+    """
+    read_before: Set[str] = set()
+    candidates = []
+    for i in range(start, end + 1):
+        inst = insts[i]
+        dest = inst.writes()
+        if (dest in single and dest not in read_before and inst.is_known()
+                and (inst.opcode == 'set' or inst.opcode == 'op' and inst.words[1] in ops.OPERATIONS)):
+            candidates.append(i)
+        read_before.update(w for w in inst.reads() if is_temp(w))
+    hoisted = []
+    invariant: Set[str] = set()
+    for i in candidates:  # temporaries are written before read, so one pass finds the operands hoisted
+        if all(not w.startswith('@') and (w not in written or w in invariant) for w in insts[i].reads()):
+            hoisted.append(i)
+            invariant.add(insts[i].writes())
+    return hoisted
+
+
+def _reductions(insts: List[Inst], start: int, end: int, depth: int, written: Set[str], single: Set[str],
+                reads: Dict[str, int]) -> List[Tuple[str, _Linear, List[int]]]:
+    """
+    Find the linear functions of induction variables worth holding in temporaries.
+    :param written: Variables written in the loop, other than by the code hoisted.
+    :return: For each function, the temporary holding it, the function, and the indices of the operations
+        no longer needed, in order, the last of which computes the function.
+    """
+    steps: Dict[str, List[float]] = {}
+    others: Set[str] = set()
+    for i in range(start, end + 1):
+        inst = insts[i]
+        w = inst.words
+        for var in inst.may_write():
+            step = ops.parse_number(w[4]) if inst.is_known() and w[0] == 'op' and w[2] == w[3] else None
+            if step is not None and w[1] in ('add', 'sub'):
+                steps.setdefault(var, []).append(step if w[1] == 'add' else -step)
+            else:
+                others.add(var)
+    inductions = {var for var in steps if var not in others and not var.startswith('@')}
+    if not inductions:
+        return []
+    jump_targets = {target for i in range(start, end + 1) for target in insts[i].targets()}
+
+    linear: Dict[str, _Linear] = {}
+    definition: Dict[str, int] = {}
+    for i in range(start, end + 1):
+        inst = insts[i]
+        w = inst.words
+        if w[0] != 'op' or w[1] not in ('add', 'sub', 'mul') or not inst.is_known() or w[2] not in single:
+            continue
+        a, b = w[3], w[4]
+        if w[1] != 'sub' and a not in inductions and a not in linear:
+            a, b = b, a
+        base = (a, 1.0, ()) if a in inductions else linear.get(a)
+        if base is None:
+            continue
+        if w[1] == 'mul':
+            k = ops.parse_number(b)
+            if k is None or base[2]:
+                continue
+            form = base[0], base[1] * k, ()
+        elif not b.startswith('@') and b not in written:
+            form = base[0], base[1], base[2] + ((w[1] == 'add', b),)
+        else:
+            continue
+        if _used_locally(insts, i, end, w[2], form[0], reads, jump_targets):
+            linear[w[2]] = form
+            definition[w[2]] = i
+
+    readers: Dict[str, List[int]] = {}
+    for i in range(start, end + 1):
+        for word in insts[i].reads():
+            if word in linear:
+                readers.setdefault(word, []).append(i)
+    result = []
+    for temp, form in linear.items():
+        var, factor, terms = form
+        if all(insts[i].writes() in linear for i in readers.get(temp, ())):
+            continue  # only an operand of other functions
+        # the temporary must take the same values as the chain, which sums of fractions do not,
+        # assuming the values entering the loop are integers, see the module docstring
+        constants = [factor] + steps[var] + [factor * step for step in steps[var]]
+        if any(not abs(x) < _MAX_EXACT or x != int(x) for x in constants):
+            continue
+        chain = [definition[temp]]
+        pending = [temp]
+        while pending:
+            for word in insts[definition[pending.pop()]].reads():
+                if word in linear and definition[word] not in chain and set(readers[word]) <= set(chain):
+                    chain.append(definition[word])
+                    pending.append(word)
+        # the chain runs on each iteration, while the temporary is set in front of the loop, and updated along
+        # with the variable
+        size = 1 + len(terms) + len(steps[var]) - len(chain)
+        saved = ((len(chain) - len(steps[var])) * cost.frequency(depth)
+                 - (1 + len(terms)) * cost.frequency(depth - 1))
+        if cost.worth(size, saved):
+            result.append((temp, form, sorted(chain)))
+    return result
+
+
+def _used_locally(insts: List[Inst], i: int, end: int, temp: str, var: str, reads: Dict[str, int],
+                  jump_targets: Set[int]) -> bool:
+    """
+    :return: Whether `temp`, written at `i`, is only read in the same basic block after `i`, before `var` changes.
+    """
+    remaining = reads.get(temp, 0)
+    k = i
+    while remaining:
+        if insts[k].target is not None or insts[k].ends_flow() or not insts[k].is_known():
+            return False
+        k += 1
+        if k > end or k in jump_targets:
+            return False
+        remaining -= insts[k].reads().count(temp)
+        if insts[k].writes() == var and remaining:
+            return False
+    return True
@@ -1,41 +1,686 @@
+import argparse
+import cProfile
+import functools
+import io
+import itertools
+import os
 import sys
-from typing import TextIO
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import TextIO, List, Optional, Iterator, Dict, Tuple
 
+import cfg
+import cse
+import deadstores
 import g
+import incremental
+import loops
+import peephole
+import phases
+import regalloc
 import syntax
+from cache import CompileCache, DEFAULT_MAX_SIZE
 
+OUTPUT_SUFFIX = '.mlog'
+SOURCE_MAP_SUFFIX = '.map'
+WATCH_INTERVAL = 0.2  # seconds between checks of the modification times in watch mode
 
-def main():
-    if len(sys.argv) != 2:
-        print(f'Usage: {sys.argv[0]} source_file', file=sys.stderr)
-        return
 
-    if sys.argv[1] == '-':
-        do_compile(sys.stdin)
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Compile MindC source files to Mindustry processor instructions.')
+    parser.add_argument('sources', nargs='*', metavar='source_file',
+                        help='source file to compile, or "-" to read from stdin')
+    parser.add_argument('-o', '--output-dir', metavar='DIR',
+                        help=f'write each result to DIR/<name>{OUTPUT_SUFFIX} instead of next to its source')
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                        help='number of worker processes in batch mode (default: number of CPUs)')
+    parser.add_argument('-O', dest='level', choices=sorted(g.Options.LEVELS), default='2',
+                        help='optimization level: 0 for none, 1 for the quick ones making code both smaller and '
+                             'faster, 2 for all, trading size for speed, s for all, making code as small as possible; '
+                             'the --no-* options turn off single optimizations (default: %(default)s)')
+    parser.add_argument('--max-instructions', type=int, default=0, metavar='N',
+                        help='trade speed for size as needed for the code to fit in N instructions, '
+                             'and fail if it cannot, e.g. 1000 for a processor')
+    parser.add_argument('--no-fold', action='store_true',
+                        help='do not evaluate constant expressions or simplify algebraic identities')
+    parser.add_argument('--no-cse', action='store_true',
+                        help='compute repeated operations again instead of reusing values computed before')
+    parser.add_argument('--owned-cells', type=lambda names: tuple(name for name in names.split(',') if name),
+                        default=(), metavar='CELLS',
+                        help='comma-separated memory cells and banks no other processor writes, e.g. cell1,bank1, '
+                             'so that values read from or written to them are reused instead of read again')
+    parser.add_argument('--no-loop-opt', action='store_true',
+                        help='do not move invariant operations out of loops or reduce induction variables')
+    parser.add_argument('--no-dead-stores', action='store_true',
+                        help='keep assignments to variables never read')
+    parser.add_argument('--no-reuse-temps', action='store_true',
+                        help='give every intermediate value its own temporary variable')
+    parser.add_argument('--no-peephole', action='store_true',
+                        help='do not thread jumps or remove useless and unreachable instructions')
+    parser.add_argument('--no-inline', action='store_true', help='always call functions instead of inlining them')
+    parser.add_argument('--inline-budget', type=int, metavar='N',
+                        help=f'number of instructions inlining small functions may add '
+                             f'(default: {g.Options().inline_budget})')
+    parser.add_argument('--stats', action='store_true',
+                        help='report the number of instructions before and after optimization, and the assignments '
+                             'removed as never read, on stderr')
+    parser.add_argument('--source-map', action='store_true',
+                        help=f'write the source line of each instruction to <output>{SOURCE_MAP_SUFFIX}, '
+                             f'where <output> is where the code is written in batch mode')
+    parser.add_argument('--stream', action='store_true',
+                        help='write instructions as they are generated instead of when all are done, for very large '
+                             'programs; implies --no-cse, --no-loop-opt, --no-dead-stores, --no-reuse-temps and '
+                             '--no-peephole, and places functions first')
+    parser.add_argument('--timings', action='store_true',
+                        help='report the time and size of each compiling phase on stderr, summed over all files')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='profile the compile with cProfile and write the statistics to FILE')
+    parser.add_argument('--watch', action='store_true',
+                        help='compile each file again whenever it changes, to where it is written in batch mode, '
+                             'parsing and generating only the functions changed; stop with Ctrl-C')
+    parser.add_argument('--serve', metavar='SOCKET',
+                        help='instead of compiling files, answer compile requests on the Unix domain socket SOCKET, '
+                             'see server.py for the protocol; -j limits the requests compiled at the same time')
+    parser.add_argument('--no-cache', action='store_true', help='do not read or write the compile cache')
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help='directory of the compile cache (default: $MINDC_CACHE_DIR or ~/.cache/mindc)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_SIZE // 1024 // 1024, metavar='MB',
+                        help='evict least recently used entries when the cache grows beyond MB megabytes')
+    args = parser.parse_args()
+
+    options = g.Options.level(args.level)
+    options.fold_constants = options.fold_constants and not args.no_fold
+    options.cse = options.cse and not args.no_cse
+    options.optimize_loops = options.optimize_loops and not args.no_loop_opt
+    options.owned_cells = args.owned_cells
+    options.remove_dead_stores = options.remove_dead_stores and not args.no_dead_stores
+    options.reuse_temps = options.reuse_temps and not args.no_reuse_temps
+    options.peephole = options.peephole and not args.no_peephole
+    options.inline = options.inline and not args.no_inline
+    if args.inline_budget is not None:
+        options.inline_budget = args.inline_budget
+    if args.max_instructions < 0:
+        parser.error('the maximum number of instructions cannot be negative')
+    if args.max_instructions and args.stream:
+        parser.error('--max-instructions cannot be combined with --stream')
+    options.max_instructions = args.max_instructions
+    if args.serve is not None:
+        if args.sources:
+            parser.error('source files cannot be given to the server')
+        if args.jobs is not None and args.jobs < 1:
+            parser.error('the number of jobs must be positive')
+        import server  # only here, as the server imports this module for the compiler
+
+        try:
+            server.serve(args.serve, options,
+                         None if args.no_cache else CompileCache(args.cache_dir, args.cache_size * 1024 * 1024),
+                         args.jobs)
+        except OSError as e:
+            print(f'Failed to serve on {args.serve}: {e}', file=sys.stderr)
+            return 1
+        return 0
+    if not args.sources:
+        parser.error('no source file is given')
+    if args.watch:
+        if '-' in args.sources:
+            parser.error('stdin cannot be watched')
+        if args.stream or args.timings or args.profile is not None:
+            parser.error('--watch cannot be combined with --stream, --timings or --profile')
+        return watch(args.sources, args.output_dir, options, args.stats, args.source_map)
+
+    measured = args.timings or args.profile is not None
+    # measured compiles run every phase, in this process
+    cache = None if args.no_cache or measured else CompileCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    jobs = args.jobs
+    if measured:
+        if jobs is not None and jobs > 1:
+            parser.error('--timings and --profile only work with a single job')
+        jobs = 1 if jobs is not None or len(args.sources) > 1 else None
+    if len(args.sources) == 1 and args.output_dir is None and jobs is None:
+        if args.source_map and args.sources[0] == '-':
+            parser.error('a source map cannot be written when reading from stdin')
+        run = functools.partial(compile_to_stdout, args.sources[0], options, cache, args.stats, args.source_map,
+                                args.stream)
     else:
+        if '-' in args.sources:
+            parser.error('stdin cannot be used in batch mode')
+        if jobs is not None and jobs < 1:
+            parser.error('the number of jobs must be positive')
+        run = functools.partial(compile_batch, args.sources, args.output_dir, jobs, options, cache, args.stats,
+                                args.source_map, args.stream)
+    if not measured:
+        return run()
+
+    timings = _Timings()
+    profile = cProfile.Profile() if args.profile is not None else None
+    phases.subscribe(timings)
+    try:
+        status = run() if profile is None else profile.runcall(run)
+    finally:
+        phases.unsubscribe(timings)
+    if args.timings:
+        timings.report()
+    if profile is not None:
         try:
-            with open(sys.argv[1]) as f:
-                do_compile(f)
+            profile.dump_stats(args.profile)
         except IOError:
-            print('Failed to open source file.', file=sys.stderr)
+            print(f'Failed to write profile {args.profile}.', file=sys.stderr)
+            return 1
+    return status
 
 
-def do_compile(file: TextIO):
-    g.file = file
+def compile_to_stdout(path: str, options: Optional[g.Options] = None, cache: Optional[CompileCache] = None,
+                      stats: bool = False, source_map: bool = False, stream: bool = False) -> int:
+    """
+    Compile a file and print the code.
+    :param source_map: Whether to write the source map to where the code would be written in batch mode,
+        with `SOURCE_MAP_SUFFIX` appended.
+    :param stream: Whether to print the code as it is generated, see `compile_stream`.
+    """
+    if path == '-':
+        sys.stdin.reconfigure(errors='strict')  # undecodable bytes are reported, not escaped into the source
+        return do_compile(sys.stdin, options, cache, stats, stream=stream)
+    try:
+        with open(path) as f:
+            return do_compile(f, options, cache, stats,
+                              output_path(path, None) + SOURCE_MAP_SUFFIX if source_map else None, stream)
+    except IOError:
+        print('Failed to open source file.', file=sys.stderr)
+        return 1
+
 
+def do_compile(file: TextIO, options: Optional[g.Options] = None, cache: Optional[CompileCache] = None,
+               stats: bool = False, source_map: Optional[str] = None, stream: bool = False) -> int:
+    counts = {} if stats else None
+    removed = [] if stats else None
+    origins = [] if source_map is not None else None
     try:
-        prog = syntax.program()
-    except g.ParseError as e:
-        print(f'Line {e.line} Character {e.pos}: {e.message}', file=sys.stderr)
-        return
-
-    prog.generate()
-    for inst, label in g.code:
-        if label is None:
-            print(inst)
+        if stream:
+            compile_stream(file, sys.stdout, options, counts, origins)
+            code = []
+        # without cache, instructions are formatted as they are printed, rather than all being held in a list
+        elif cache is None:
+            code = _format(_compile(file, options, counts, origins, removed))
         else:
-            print(inst.format(label.inst))
+            code = compile_file(file, options, cache, counts, origins, removed)
+    except (g.ParseError, g.SizeError, RecursionError, UnicodeDecodeError) as e:
+        print(_describe_error(e), file=sys.stderr)
+        return 1
+
+    for inst in code:
+        print(inst)
+    if counts is not None:
+        for var, origin in removed:
+            print(_describe_removed(var, origin), file=sys.stderr)
+        print(_describe_counts(counts), file=sys.stderr)
+    if origins is not None:
+        try:
+            _write_source_map(source_map, origins)
+        except IOError:
+            print(f'Failed to write source map {source_map}.', file=sys.stderr)
+            return 1
+    return 0
+
+
+def compile_batch(sources: List[str], output_dir: Optional[str], jobs: Optional[int],
+                  options: Optional[g.Options] = None, cache: Optional[CompileCache] = None,
+                  stats: bool = False, source_map: bool = False, stream: bool = False) -> int:
+    """
+    Compile each source file to its own output file, distributing the files over a pool of worker processes.
+    A failing file is reported on stderr and does not stop the others.
+    :param sources: Paths of source files.
+    :param output_dir: Directory to write results to. If `None`, each result is written next to its source.
+    :param jobs: Number of worker processes. If `None`, use the number of CPUs.
+    :param options: Compiling options, or `None` for the defaults.
+    :param cache: The compile cache to consult, or `None` to always compile.
+    :param stats: Whether to report the instruction counts of each file and their totals on stderr,
+        along with the stores removed as dead.
+    :param source_map: Whether to write the source map of each file next to its output.
+    :param stream: Whether to write the code of each file as it is generated, see `compile_stream`.
+    :return: The exit status: 0 if all files are compiled, otherwise 1.
+    """
+    outputs = [output_path(src, output_dir) for src in sources]
+    if len(set(outputs)) != len(outputs):
+        print('Several source files would be compiled to the same output file.', file=sys.stderr)
+        return 1
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    jobs = min(jobs or os.cpu_count() or 1, len(sources))
+    if jobs == 1:
+        results = map(_compile_one, sources, outputs, itertools.repeat(options), itertools.repeat(cache),
+                      itertools.repeat(stats), itertools.repeat(source_map), itertools.repeat(stream))
+    else:
+        executor = ProcessPoolExecutor(jobs)
+        # large chunks amortize inter-process communication, while several chunks per worker keep the load balanced
+        chunk_size = max(1, len(sources) // (jobs * 4))
+        results = executor.map(_compile_one, sources, outputs, itertools.repeat(options), itertools.repeat(cache),
+                               itertools.repeat(stats), itertools.repeat(source_map),
+                               itertools.repeat(stream), chunksize=chunk_size)
+
+    failed = 0
+    total = {'generated': 0, 'emitted': 0}
+    try:
+        for src, (error, counts, removed) in zip(sources, results):
+            if error is not None:
+                failed += 1
+                print(f'{src}: {error}', file=sys.stderr)
+            elif counts is not None:
+                for var, origin in removed:
+                    print(f'{src}: {_describe_removed(var, origin)}', file=sys.stderr)
+                print(f'{src}: {_describe_counts(counts)}', file=sys.stderr)
+                for name in total:
+                    total[name] += counts[name]
+    finally:
+        if jobs != 1:
+            executor.shutdown()
+    if stats:
+        print(f'total: {_describe_counts(total)}', file=sys.stderr)
+    if failed:
+        print(f'{failed} of {len(sources)} files failed to compile.', file=sys.stderr)
+    return 1 if failed else 0
+
+
+def watch(sources: List[str], output_dir: Optional[str], options: Optional[g.Options] = None,
+          stats: bool = False, source_map: bool = False) -> int:
+    """
+    Compile each source file whenever it is modified, until interrupted, reporting each compile on stderr.
+    Each file has its own `incremental.FunctionCache`, so the functions unchanged since its last compile
+    are not parsed or generated again. Parameters are the same as `compile_batch`.
+    :return: The exit status: 0 once interrupted, or 1 if the outputs cannot be written.
+    """
+    outputs = [output_path(src, output_dir) for src in sources]
+    if len(set(outputs)) != len(outputs):
+        print('Several source files would be compiled to the same output file.', file=sys.stderr)
+        return 1
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    caches = [incremental.FunctionCache(options) for _ in sources]
+    modified: List[Optional[int]] = [None] * len(sources)
+    try:
+        while True:
+            for i, src in enumerate(sources):
+                try:
+                    mtime = os.stat(src).st_mtime_ns
+                except OSError:
+                    continue  # e.g. being replaced by an editor
+                if mtime != modified[i]:
+                    modified[i] = mtime
+                    for line in _watch_one(src, outputs[i], caches[i], stats, source_map).splitlines():
+                        print(f'{src}: {line}', file=sys.stderr)
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        return 0
+
+
+def _watch_one(source: str, output: str, functions: incremental.FunctionCache, stats: bool,
+               source_map: bool) -> str:
+    """
+    Compile a single file in watch mode.
+    :return: The error message if failed, otherwise a summary of the compile, preceded by the stores removed
+        as dead if `stats` is set, one per line.
+    """
+    counts = {} if stats else None
+    removed = [] if stats else None
+    origins = [] if source_map else None
+    start = time.perf_counter()
+    try:
+        with open(source) as f:
+            code = compile_incremental(f.read(), functions, counts, origins, removed)
+    except (g.ParseError, g.SizeError, RecursionError, UnicodeDecodeError) as e:
+        return _describe_error(e)
+    except IOError:
+        return 'Failed to open source file.'
+    seconds = time.perf_counter() - start
+    try:
+        with open(output, 'w') as f:
+            f.writelines(inst + '\n' for inst in code)
+    except IOError:
+        return f'Failed to write output file {output}.'
+    if origins is not None:
+        try:
+            _write_source_map(output + SOURCE_MAP_SUFFIX, origins)
+        except IOError:
+            return f'Failed to write source map {output}{SOURCE_MAP_SUFFIX}.'
+    summary = f'compiled in {seconds * 1000:.0f} ms, {functions.reused} of {len(functions)} functions reused'
+    if counts is None:
+        return summary
+    return ''.join(f'{_describe_removed(var, origin)}\n' for var, origin in removed) + \
+        f'{summary}; {_describe_counts(counts)}'
+
+
+def output_path(source: str, output_dir: Optional[str]) -> str:
+    stem = os.path.splitext(source)[0]
+    if output_dir is None:
+        return stem + OUTPUT_SUFFIX
+    return os.path.join(output_dir, os.path.basename(stem) + OUTPUT_SUFFIX)
+
+
+def _compile_one(source: str, output: str, options: Optional[g.Options], cache: Optional[CompileCache],
+                 stats: bool, source_map: bool,
+                 stream: bool) -> Tuple[Optional[str], Optional[Dict[str, int]],
+                                        Optional[List[Tuple[str, Optional[g.Origin]]]]]:
+    """
+    Compile a single file in batch mode.
+    :return: The error message if failed, otherwise `None`; and the instruction counts and the stores removed
+        as dead if `stats` is set.
+    """
+    counts = {} if stats else None
+    removed = [] if stats else None
+    origins = [] if source_map else None
+    if stream:
+        error = _stream_one(source, output, options, counts, origins)
+        if error is not None:
+            return error, None, None
+    else:
+        try:
+            with open(source) as f:
+                code = compile_file(f, options, cache, counts, origins, removed)
+        except (g.ParseError, g.SizeError, RecursionError, UnicodeDecodeError) as e:
+            return _describe_error(e), None, None
+        except IOError:
+            return 'Failed to open source file.', None, None
+        try:
+            with open(output, 'w') as f:
+                f.writelines(inst + '\n' for inst in code)
+        except IOError:
+            return f'Failed to write output file {output}.', None, None
+    if origins is not None:
+        try:
+            _write_source_map(output + SOURCE_MAP_SUFFIX, origins)
+        except IOError:
+            return f'Failed to write source map {output}{SOURCE_MAP_SUFFIX}.', None, None
+    return None, counts, removed
+
+
+def _stream_one(source: str, output: str, options: Optional[g.Options], counts: Optional[Dict[str, int]],
+                origins: Optional[List[Optional[g.Origin]]]) -> Optional[str]:
+    """
+    Compile a single file in batch mode, writing the code as it is generated. The output is removed on failure.
+    :return: The error message if failed, otherwise `None`.
+    """
+    try:
+        f = open(source)
+    except IOError:
+        return 'Failed to open source file.'
+    try:
+        with f, open(output, 'w') as out:
+            compile_stream(f, out, options, counts, origins)
+        return None
+    except (g.ParseError, g.SizeError, RecursionError, UnicodeDecodeError) as e:
+        error = _describe_error(e)
+    except IOError:
+        error = f'Failed to write output file {output}.'
+    try:
+        os.remove(output)
+    except OSError:
+        pass
+    return error
+
+
+def compile(source: str, options: Optional[g.Options] = None, cache: Optional[CompileCache] = None,
+            stats: Optional[Dict[str, int]] = None, source_map: Optional[List[Optional[g.Origin]]] = None,
+            removed_stores: Optional[List[Tuple[str, Optional[g.Origin]]]] = None) -> List[str]:
+    """
+    Compile MindC source code. Each call works on its own compilation unit,
+    so this function may be called repeatedly and from several threads at once.
+    :param source: The source code.
+    :param options: Compiling options, or `None` for the defaults.
+    :param cache: If given, results are looked up in and stored to the cache.
+    :param stats: If given, the number of instructions generated is stored under `'generated'`,
+        and the number after optimization under `'emitted'`.
+    :param source_map: If given, the origin of each instruction is appended to it,
+        or `None` for instructions not generated from a statement.
+    :param removed_stores: If given, the variable and the origin of each assignment removed as never read
+        are appended to it, see deadstores.py.
+        To fill `stats`, `source_map` or `removed_stores`, the code is always compiled, so the cache is only written.
+    :return: The compiled instructions, one per element.
+    :raise g.ParseError: If the source code is invalid.
+    :raise g.SizeError: If the code does not fit in `options.max_instructions`.
+    """
+    if cache is None:
+        return list(_format(_compile(io.StringIO(source), options, stats, source_map, removed_stores)))
+    key = cache.key(source, (options or g.Options()).key())
+    code = cache.get(key) if stats is None and source_map is None and removed_stores is None else None
+    if code is None:
+        code = list(_format(_compile(io.StringIO(source), options, stats, source_map, removed_stores)))
+        cache.put(key, code)
+    return code
+
+
+def compile_file(file: TextIO, options: Optional[g.Options] = None, cache: Optional[CompileCache] = None,
+                 stats: Optional[Dict[str, int]] = None,
+                 source_map: Optional[List[Optional[g.Origin]]] = None,
+                 removed_stores: Optional[List[Tuple[str, Optional[g.Origin]]]] = None) -> List[str]:
+    """
+    Same as `compile`, but reads the source code from an opened file.
+    """
+    if cache is None:
+        return list(_format(_compile(file, options, stats, source_map, removed_stores)))
+    return compile(file.read(), options, cache, stats, source_map, removed_stores)
+
+
+def compile_incremental(source: str, functions: incremental.FunctionCache, stats: Optional[Dict[str, int]] = None,
+                        source_map: Optional[List[Optional[g.Origin]]] = None,
+                        removed_stores: Optional[List[Tuple[str, Optional[g.Origin]]]] = None) -> List[str]:
+    """
+    Same as `compile` with the options of `functions`, but only parses and generates the functions changed
+    since the last compile with `functions`, reusing the others, see incremental.py.
+    The code is the same as that of `compile`. The passes over the whole code still run on all of it.
+    :raise g.ParseError: If the source code is invalid.
+    :raise g.SizeError: As of `compile`.
+    """
+    try:
+        with g.compiling(g.CompilationUnit(io.StringIO(source), functions.options)) as unit:
+            functions.generate(source)
+            removed = [] if removed_stores is not None else None
+            code = _optimize(unit.code, unit.options, removed)
+            limit = unit.options.max_instructions
+            if limit and len(code) > limit:
+                # the options are backed off for the whole code, which the cached functions were not generated with
+                return compile(source, functions.options, None, stats, source_map, removed_stores)
+            if stats is not None:
+                stats['generated'] = len(unit.code)
+                stats['emitted'] = len(code)
+            if source_map is not None:
+                source_map.extend(code.origin(i) for i in range(len(code)))
+            if removed_stores is not None:
+                removed_stores.extend(removed)
+            return list(_format(code))
+    except g.ParseError:
+        # functions are parsed out of order, so compile as usual to report the first error
+        return compile(source, functions.options, None, stats, source_map, removed_stores)
+
+
+def compile_stream(file: TextIO, out: TextIO, options: Optional[g.Options] = None,
+                   stats: Optional[Dict[str, int]] = None,
+                   source_map: Optional[List[Optional[g.Origin]]] = None):
+    """
+    Compile, writing the code to `out` as it is generated rather than when all of it is done, which bounds
+    the memory used by the code to the longest span of forward jumps waiting for their targets.
+    Without inlining, each statement of the main procedure is also released before the next one is parsed.
+    The code differs from that of `compile_file`: the passes over the whole code do not run, ignoring `cse`,
+    `optimize_loops`, `remove_dead_stores`, `reuse_temps` and `peephole`, and functions are placed first,
+    so calls jump back to code already written.
+    On a parse error, the code written so far is incomplete.
+    The parse, fold and generate phases are interleaved, and are reported together as `generate`.
+    As the code is written before its size is known, it cannot be made smaller to fit in `max_instructions`.
+    :param stats: As of `compile`, both counts are the same.
+    :param source_map: As of `compile`.
+    :raise g.ParseError: If the source code is invalid.
+    :raise g.SizeError: If the code written does not fit in `options.max_instructions`.
+    """
+    with g.compiling(g.CompilationUnit(file, options)) as unit:
+        unit.code = code = g.CodeStream(out, source_map)
+        with phases.phase(phases.GENERATE, lambda: {'instructions': len(code)}):
+            prog = syntax.functions()
+            statements = syntax.main_procedure(prog)
+            if unit.options.inline:
+                statements = prog.main_procedure = list(statements)  # calls are counted to plan inlining
+            prog.generate_streaming(statements)
+            code.close()
+        if stats is not None:
+            stats['generated'] = stats['emitted'] = len(code)
+        if unit.options.max_instructions and len(code) > unit.options.max_instructions:
+            raise g.SizeError(len(code), unit.options.max_instructions)
+
+
+def _compile(file: TextIO, options: Optional[g.Options], stats: Optional[Dict[str, int]] = None,
+             source_map: Optional[List[Optional[g.Origin]]] = None,
+             removed_stores: Optional[List[Tuple[str, Optional[g.Origin]]]] = None) -> g.CodeBuffer:
+    """
+    With `max_instructions` set, code too long is compiled again with options trading more speed for size,
+    until it fits.
+    :raise g.SizeError: If the code does not fit even in the smallest form.
+    """
+    options = options or g.Options()
+    limit = options.max_instructions
+    if limit:
+        source = file.read()
+        while True:
+            removed = [] if removed_stores is not None else None  # by the last attempt only
+            code = _compile_once(io.StringIO(source), options, stats, removed)
+            if len(code) <= limit:
+                break
+            options = options.backed_off()
+            if options is None:
+                raise g.SizeError(len(code), limit)
+        if removed_stores is not None:
+            removed_stores.extend(removed)
+    else:
+        code = _compile_once(file, options, stats, removed_stores)
+    if source_map is not None:
+        source_map.extend(code.origin(i) for i in range(len(code)))
+    return code
+
+
+def _compile_once(file: TextIO, options: g.Options, stats: Optional[Dict[str, int]],
+                  removed_stores: Optional[List[Tuple[str, Optional[g.Origin]]]]) -> g.CodeBuffer:
+    with g.compiling(g.CompilationUnit(file, options)) as unit:
+        _generate()  # the syntax tree is released before the code passes run
+        code = _optimize(unit.code, unit.options, removed_stores)
+        if stats is not None:
+            stats['generated'] = len(unit.code)
+            stats['emitted'] = len(code)
+        return code
+
+
+def _generate():
+    unit = g.unit()
+    if phases.observed():
+        unit.lex_seconds = 0.0
+    with phases.phase(phases.PARSE, lambda: {'lex_seconds': unit.lex_seconds, 'tokens': unit.token_count,
+                                             'nodes': prog.count_nodes()}):
+        prog = syntax.program()
+    if unit.options.fold_constants:
+        with phases.phase(phases.FOLD, lambda: {'nodes': prog.count_nodes()}):
+            prog.fold()
+    with phases.phase(phases.GENERATE, lambda: {'instructions': len(unit.code)}):
+        prog.generate()
+
+
+def _optimize(code: g.CodeBuffer, options: g.Options,
+              removed_stores: Optional[List[Tuple[str, Optional[g.Origin]]]] = None) -> g.CodeBuffer:
+    if not (options.cse or options.optimize_loops or options.remove_dead_stores or options.reuse_temps
+            or options.peephole):
+        return code
+    with phases.phase(phases.OPTIMIZE, lambda: {'instructions': len(optimized)}):
+        insts = cfg.load(code)
+        if options.cse:
+            insts = cse.eliminate(insts, options.owned_cells)
+        if options.optimize_loops:
+            insts = loops.optimize(insts)
+        if options.remove_dead_stores:
+            insts = deadstores.eliminate(insts, removed_stores)
+        if options.reuse_temps:
+            insts = regalloc.allocate(insts)
+        if options.peephole:
+            insts = peephole.optimize(insts)
+        optimized = cfg.store(insts)
+    return optimized
+
+
+def _describe_error(e: Exception) -> str:
+    if isinstance(e, g.ParseError):
+        return f'Line {e.line} Character {e.pos}: {e.message}'
+    if isinstance(e, RecursionError):
+        return 'The source is nested too deeply.'
+    if isinstance(e, UnicodeDecodeError):
+        return f'The source file is not valid {e.encoding} text.'
+    return e.message
+
+
+def _describe_removed(var: str, origin: Optional[g.Origin]) -> str:
+    message = f'Removed assignment to {var}, which is never read.'
+    return message if origin is None else f'Line {origin[0]} Character {origin[1]}: {message}'
+
+
+def _describe_counts(counts: Dict[str, int]) -> str:
+    generated, emitted = counts['generated'], counts['emitted']
+    saved = f' ({(emitted - generated) / generated:+.1%})' if generated else ''
+    return f'{generated} instructions generated, {emitted} emitted{saved}'
+
+
+def _write_source_map(path: str, origins: List[Optional[g.Origin]]):
+    """
+    Each line of a source map is `index line:column [function]`, or `index -` for code not from a statement,
+    and applies to the instructions from `index` up to the next line.
+    """
+    with open(path, 'w') as f:
+        f.write('# instruction line:column function\n')
+        for i, origin in enumerate(origins):
+            if i == 0 or origin != origins[i - 1]:
+                if origin is None:
+                    f.write(f'{i} -\n')
+                else:
+                    line, pos, function = origin
+                    f.write(f'{i} {line}:{pos}{" " + function if function is not None else ""}\n')
+
+
+def _format(code: g.CodeBuffer) -> Iterator[str]:
+    with phases.phase(phases.FORMAT, lambda: {'instructions': len(code)}):
+        for inst, label in code:
+            yield inst if label is None else inst.format(label.inst)
+
+
+class _Timings(phases.Listener):
+    """
+    Sums of the metrics of each phase, reported by `--timings`.
+    The lexer runs within the parse phase, and is reported separately.
+    """
+
+    _COLUMNS = ('seconds', 'tokens', 'nodes', 'instructions')
+
+    totals: Dict[str, Dict[str, float]]
+
+    def __init__(self):
+        self.totals = {}
+
+    def phase_ended(self, phase: str, metrics: Dict[str, float]):
+        metrics = dict(metrics)
+        if phase == phases.PARSE:
+            lex_seconds = metrics.pop('lex_seconds')
+            metrics['seconds'] -= lex_seconds
+            self._add('lex', {'seconds': lex_seconds, 'tokens': metrics.pop('tokens')})
+        self._add(phase, metrics)
+
+    def _add(self, phase: str, metrics: Dict[str, float]):
+        total = self.totals.setdefault(phase, {})
+        for name, value in metrics.items():
+            total[name] = total.get(name, 0) + value
+
+    def report(self):
+        if not self.totals:
+            return  # nothing was compiled
+        rows = [(phase, self.totals[phase]) for phase in ('lex',) + phases.ALL if phase in self.totals]
+        rows.append(('total', {'seconds': sum(metrics['seconds'] for _, metrics in rows)}))
+        print(f'{"phase":<10}' + ''.join(f'{name:>14}' for name in self._COLUMNS), file=sys.stderr)
+        for phase, metrics in rows:
+            cells = [f'{metrics["seconds"]:.3f}'] + [f'{metrics[name]:.0f}' if name in metrics else ''
+                                                      for name in self._COLUMNS[1:]]
+            print(f'{phase:<10}' + ''.join(f'{cell:>14}' for cell in cells), file=sys.stderr)
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Semantics of Mindustry `operation` instructions on numbers, following the game's implementation in Java.
+Results may be infinite or NaN, which the game stores as `null`.
+"""
+import math
+import re
+from typing import Callable, Dict, Optional
+
+_EPSILON = 0.000001
+
+
+def to_long(x: float) -> int:
+    """
+    Convert like Java's `(long) x`.
+    """
+    if math.isnan(x):
+        return 0
+    if x >= 2 ** 63:
+        return 2 ** 63 - 1
+    if x <= -2 ** 63:
+        return -2 ** 63
+    return int(x)
+
+
+def _from_long(x: int) -> float:
+    x &= 2 ** 64 - 1
+    return float(x - 2 ** 64 if x >= 2 ** 63 else x)
+
+
+def _div(a: float, b: float) -> float:
+    if b != 0:
+        return a / b
+    if a == 0 or math.isnan(a):
+        return math.nan
+    return math.copysign(math.inf, a) * math.copysign(1, b)
+
+
+def _idiv(a: float, b: float) -> float:
+    quotient = _div(a, b)
+    return float(math.floor(quotient)) if math.isfinite(quotient) else quotient
+
+
+def _mod(a: float, b: float) -> float:
+    if b == 0 or math.isinf(a):
+        return math.nan
+    return math.fmod(a, b)
+
+
+def _pow(a: float, b: float) -> float:
+    try:
+        return math.pow(a, b)
+    except ValueError:
+        return math.nan
+    except OverflowError:
+        return math.inf
+
+
+def _log(func: Callable[[float], float]) -> Callable[[float, float], float]:
+    def log(a: float, _: float) -> float:
+        if a == 0:
+            return -math.inf
+        if a < 0 or math.isnan(a):
+            return math.nan
+        return func(a)
+
+    return log
+
+
+def _sqrt(a: float, _: float) -> float:
+    return math.sqrt(a) if a >= 0 else math.nan
+
+
+def _angle(x: float, y: float) -> float:
+    angle = math.degrees(math.atan2(y, x))
+    return angle + 360 if angle < 0 else angle
+
+
+# `rand` and `noise` are not pure functions of their operands, so they are not listed here
+OPERATIONS: Dict[str, Callable[[float, float], float]] = {
+    'add': lambda a, b: a + b,
+    'sub': lambda a, b: a - b,
+    'mul': lambda a, b: a * b,
+    'div': _div,
+    'idiv': _idiv,
+    'mod': _mod,
+    'pow': _pow,
+    'equal': lambda a, b: float(abs(a - b) < _EPSILON),
+    'notEqual': lambda a, b: float(not abs(a - b) < _EPSILON),
+    'land': lambda a, b: float(a != 0 and b != 0),
+    'lessThan': lambda a, b: float(a < b),
+    'lessThanEq': lambda a, b: float(a <= b),
+    'greaterThan': lambda a, b: float(a > b),
+    'greaterThanEq': lambda a, b: float(a >= b),
+    'shl': lambda a, b: _from_long(to_long(a) << (to_long(b) & 63)),
+    'shr': lambda a, b: _from_long(to_long(a) >> (to_long(b) & 63)),
+    'or': lambda a, b: _from_long(to_long(a) | to_long(b)),
+    'and': lambda a, b: _from_long(to_long(a) & to_long(b)),
+    'xor': lambda a, b: _from_long(to_long(a) ^ to_long(b)),
+    'not': lambda a, _: _from_long(~to_long(a)),
+    'max': lambda a, b: max(a, b),
+    'min': lambda a, b: min(a, b),
+    'atan2': _angle,
+    'dst': lambda a, b: math.hypot(a, b),
+    'abs': lambda a, _: abs(a),
+    'log': _log(math.log),
+    'log10': _log(math.log10),
+    'floor': lambda a, _: float(math.floor(a)) if math.isfinite(a) else a,
+    'ceil': lambda a, _: float(math.ceil(a)) if math.isfinite(a) else a,
+    'sqrt': _sqrt,
+    'sin': lambda a, _: math.sin(math.radians(a)) if math.isfinite(a) else math.nan,
+    'cos': lambda a, _: math.cos(math.radians(a)) if math.isfinite(a) else math.nan,
+    'tan': lambda a, _: math.tan(math.radians(a)) if math.isfinite(a) else math.nan,
+}
+
+COMPARISONS = {'equal', 'notEqual', 'lessThan', 'lessThanEq', 'greaterThan', 'greaterThanEq'}
+
+
+_number_regex = re.compile(r'-?(?:\d+\.?\d*|\.\d+)')
+
+
+def parse_number(text: str) -> Optional[float]:
+    """
+    :return: The value of a number literal, or `None` if `text` is not one.
+    """
+    if not _number_regex.fullmatch(text):
+        return None
+    return float(text)
+
+
+def format_number(value: float) -> Optional[str]:
+    """
+    :return: A literal representing `value` exactly, or `None` if there is no plain decimal literal for it.
+    """
+    if not math.isfinite(value):
+        return None
+    if value == int(value) and abs(value) < 2 ** 53:
+        return str(int(value))
+    text = repr(value)
+    return None if 'e' in text else text
@@ -0,0 +1,146 @@
+"""
+Peephole optimization of generated code: jump threading, removal of jumps to the next instruction,
+of jumps with constant conditions, of no-op instructions and of unreachable code.
+Labels are renumbered as instructions are removed.
+"""
+from typing import List, Set, Optional
+
+import ops
+from cfg import Inst, has_opaque_control_flow, compact
+
+# the negation of each jump condition, for numbers
+_inverse = {
+    'equal': 'notEqual', 'notEqual': 'equal',
+    'lessThan': 'greaterThanEq', 'greaterThanEq': 'lessThan',
+    'greaterThan': 'lessThanEq', 'lessThanEq': 'greaterThan',
+}
+
+
+def optimize(insts: List[Inst]) -> List[Inst]:
+    """
+    :param insts: The code to optimize.
+    :return: The optimized code.
+    """
+    if has_opaque_control_flow(insts):
+        return insts
+    while True:
+        _thread_jumps(insts)
+        removed = _useless(insts) | _unreachable(insts)
+        removed |= _jumps_over_jumps(insts, removed)
+        if not removed:
+            return insts
+        insts = compact(insts, removed)
+
+
+def _thread_jumps(insts: List[Inst]):
+    """
+    Retarget jumps landing on unconditional jumps, and resolve jumps with constant conditions.
+    Jumping to `end` is the same as jumping past the last instruction, which restarts the program without executing
+    another instruction. An unconditional jump to a return or past the last instruction is replaced by the return
+    or an `end`, so no trailing instruction is needed to land on.
+    """
+    for i, inst in enumerate(insts):
+        if inst.table is not None:
+            inst.table = [_final_target(insts, target) for target in inst.table]
+        if inst.target is None:
+            continue
+        inst.target = _final_target(insts, inst.target)
+        condition = _evaluate(inst)
+        if condition is True and len(inst.words) > 3:
+            inst.words = ['jump', '{}', 'always']
+        if inst.is_unconditional_jump() and not _is_call(insts, i):
+            if inst.target == len(insts):
+                inst.words = ['end']
+                inst.target = None
+            elif insts[inst.target].is_return():
+                inst.words = list(insts[inst.target].words)
+                inst.target = None
+
+
+def _final_target(insts: List[Inst], target: int) -> int:
+    visited = set()
+    while target not in visited:
+        visited.add(target)
+        if target >= len(insts) or insts[target].words == ['end']:
+            return len(insts)
+        if insts[target].is_unconditional_jump() and not _is_call(insts, target):
+            target = insts[target].target
+        else:
+            break
+    return target
+
+
+def _evaluate(inst: Inst) -> Optional[bool]:
+    """
+    :return: Whether a jump is taken, or `None` if it depends on variables.
+    """
+    condition = inst.words[2]
+    if condition == 'always':
+        return True
+    if condition not in _inverse or len(inst.words) != 5:
+        return None
+    a, b = ops.parse_number(inst.words[3]), ops.parse_number(inst.words[4])
+    if a is None or b is None:
+        return None
+    return ops.OPERATIONS[condition](a, b) != 0
+
+
+def _useless(insts: List[Inst]) -> Set[int]:
+    """
+    :return: Indices of `noop`, `set a a`, jumps never taken, and jumps to the next instruction.
+    """
+    removed = set()
+    for i, inst in enumerate(insts):
+        words = inst.words
+        if words == ['noop'] or (words[0] == 'set' and len(words) == 3 and words[1] == words[2]):
+            removed.add(i)
+        elif inst.target is not None and (_evaluate(inst) is False or inst.target == i + 1):
+            removed.add(i)
+    return removed
+
+
+def _unreachable(insts: List[Inst]) -> Set[int]:
+    """
+    :return: Indices of instructions not reachable from the start. A function call reaches both the function
+    and the instruction after the call, where the function returns to.
+    """
+    reached = [False] * len(insts)
+    stack = [0] if insts else []
+    while stack:
+        i = stack.pop()
+        if i >= len(insts) or reached[i]:
+            continue
+        reached[i] = True
+        inst = insts[i]
+        if inst.target is not None:
+            stack.append(inst.target)
+            if not inst.is_unconditional_jump() or _is_call(insts, i):
+                stack.append(i + 1)
+        elif inst.table is not None:
+            stack.extend(inst.table)
+        elif not inst.ends_flow():
+            stack.append(i + 1)
+    return {i for i, r in enumerate(reached) if not r}
+
+
+def _jumps_over_jumps(insts: List[Inst], removed: Set[int]) -> Set[int]:
+    """
+    `jump L1 lessThan a b; jump L2 always; L1: ...` -> `jump L2 greaterThanEq a b; L1: ...`
+    :param removed: Instructions already to be removed, which are left untouched.
+    :return: Indices of the unconditional jumps merged into the preceding conditional jumps.
+    """
+    targets = {target for inst in insts for target in inst.targets()}
+    merged = set()
+    for i in range(len(insts) - 1):
+        inst, next_inst = insts[i], insts[i + 1]
+        if (inst.target == i + 2 and inst.words[2] in _inverse and next_inst.is_unconditional_jump()
+                and i + 1 not in targets and not next_inst.is_call(inst)
+                and not removed.intersection((i, i + 1)) and i not in merged):
+            inst.words[2] = _inverse[inst.words[2]]
+            inst.target = next_inst.target
+            merged.add(i + 1)
+    return merged
+
+
+def _is_call(insts: List[Inst], i: int) -> bool:
+    return insts[i].is_call(insts[i - 1] if i > 0 else None)
@@ -0,0 +1,80 @@
+"""
+Phases of a compilation, and hooks to observe them, e.g. to time compiles or to feed a metrics pipeline.
+A compilation runs the phases `parse`, `fold` (if enabled), `generate`, `optimize` and `format`, in this order.
+A compile answered by the cache runs none of them.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple, Callable, Optional, Iterator
+
+PARSE = 'parse'  # reading the source into a syntax tree; the lexer runs on demand within this phase
+FOLD = 'fold'
+GENERATE = 'generate'
+OPTIMIZE = 'optimize'  # the passes over the generated code
+FORMAT = 'format'  # when the code is printed as it is formatted, printing is included
+
+ALL = (PARSE, FOLD, GENERATE, OPTIMIZE, FORMAT)
+
+
+class Listener:
+    """
+    Receiver of phase events. Events are sent from the thread compiling, so compiles in several threads
+    may send events at the same time.
+    """
+
+    def phase_started(self, phase: str):
+        pass
+
+    def phase_ended(self, phase: str, metrics: Dict[str, float]):
+        """
+        Not called if the phase fails, e.g. on a syntax error.
+        :param metrics: `'seconds'` of wall time, and depending on the phase:
+            `'lex_seconds'` (the part of the time spent in the lexer), `'tokens'` and `'nodes'` for `parse`;
+            `'nodes'` for `fold`, and `'instructions'` for the later phases.
+        """
+        pass
+
+
+_listeners: Tuple[Listener, ...] = ()  # replaced rather than modified, so it can be iterated without the lock
+_lock = threading.Lock()
+
+
+def subscribe(listener: Listener):
+    global _listeners
+    with _lock:
+        _listeners = _listeners + (listener,)
+
+
+def unsubscribe(listener: Listener):
+    global _listeners
+    with _lock:
+        _listeners = tuple(x for x in _listeners if x is not listener)
+
+
+def observed() -> bool:
+    """
+    :return: Whether anyone is subscribed, i.e. whether measurements are needed.
+    """
+    return bool(_listeners)
+
+
+@contextmanager
+def phase(name: str, measure: Optional[Callable[[], Dict[str, float]]] = None) -> Iterator[None]:
+    """
+    Send the events of a phase around the `with` block.
+    :param measure: Called after the block to compute the metrics other than time, only if anyone is subscribed.
+    """
+    listeners = _listeners
+    if not listeners:
+        yield
+        return
+    for listener in listeners:
+        listener.phase_started(name)
+    start = time.perf_counter()
+    yield
+    metrics = {'seconds': time.perf_counter() - start}
+    if measure is not None:
+        metrics.update(measure())
+    for listener in listeners:
+        listener.phase_ended(name, metrics)
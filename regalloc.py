@@ -0,0 +1,220 @@
+"""
+Reuse of temporary variables. The code generator names a new temporary for every intermediate value;
+this pass coalesces copies from and into temporaries, then renames the temporaries
+so that those never alive at the same time share a name.
+"""
+from bisect import bisect_right
+from typing import List, Dict, Set, Optional
+
+import g
+from cfg import Inst, is_temp, successors, block_starts, has_opaque_control_flow, compact
+
+
+def allocate(insts: List[Inst]) -> List[Inst]:
+    """
+    :param insts: The generated code.
+    :return: The code with copies coalesced and temporaries renamed.
+    """
+    if has_opaque_control_flow(insts):
+        return insts
+    if any(not inst.is_known() and any(is_temp(w) for w in inst.words) for inst in insts):
+        return insts  # a raw statement refers to a temporary by name
+    insts = _coalesce(insts)
+    _rename(insts)
+    return insts
+
+
+def _coalesce(insts: List[Inst]) -> List[Inst]:
+    """
+    Within a basic block, compute a value directly into the variable it is copied to,
+    or read the source of a copy directly instead of the temporary copied into.
+    Only temporaries defined and used exactly once are involved.
+    """
+    def_index: Dict[str, int] = {}
+    use_index: Dict[str, int] = {}
+    use_count: Dict[str, int] = {}
+    for i, inst in enumerate(insts):
+        dest = inst.writes()
+        if dest is not None and is_temp(dest):
+            def_index[dest] = -1 if dest in def_index else i
+        for word in inst.reads():
+            if is_temp(word):
+                use_count[word] = use_count.get(word, 0) + 1
+                use_index[word] = i
+    starts = sorted(block_starts(insts))
+    removed: Set[int] = set()
+
+    def between(i: int, j: int) -> Optional[range]:
+        """
+        :return: The instructions strictly between `i` and `j`, or `None` if they are not in the same basic block.
+        """
+        if i < 0 or j <= i or bisect_right(starts, i) != bisect_right(starts, j):
+            return None
+        return range(i + 1, j)
+
+    for j, inst in enumerate(insts):
+        if inst.opcode != 'set' or not inst.is_known():
+            continue
+        dest, src = inst.words[1], inst.words[2]
+        if dest == src or dest.startswith('@'):
+            continue
+        if is_temp(src) and use_count.get(src) == 1 and not is_temp(dest):
+            # `op add $tmp$1 a b; ...; set x $tmp$1` -> `op add x a b; ...`
+            i = def_index.get(src, -1)
+            span = between(i, j)
+            if span is not None and all(k in removed or (dest not in insts[k].reads()
+                                                         and dest not in insts[k].may_write()) for k in span):
+                definition = insts[i]
+                definition.words[2 if definition.opcode == 'op' else 1] = dest
+                removed.add(j)
+                continue
+        if is_temp(dest) and use_count.get(dest) == 1 and def_index.get(dest) == j and not src.startswith('@'):
+            # `set $tmp$1 x; ...; op add y $tmp$1 1` -> `...; op add y x 1`
+            k = use_index[dest]
+            span = between(j, k)
+            if span is not None and all(m in removed or src not in insts[m].may_write() for m in span):
+                user = insts[k]
+                start = 3 if user.opcode == 'op' else 2 if user.opcode in ('set', 'read') else 1
+                user.words[start:] = [src if w == dest else w for w in user.words[start:]]
+                if is_temp(src):
+                    use_index[src] = k
+                    if def_index.get(src) == j:
+                        def_index[src] = -1
+                removed.add(j)
+    return compact(insts, removed)
+
+
+def _callee_temps(insts: List[Inst]) -> Dict[int, Set[str]]:
+    """
+    :return: For each function home, the temporaries used by the function and all functions it calls.
+    """
+    homes = {inst.target for i, inst in enumerate(insts) if i > 0 and inst.is_call(insts[i - 1])}
+    own: Dict[int, Set[str]] = {}
+    calls: Dict[int, Set[int]] = {}
+    for home in homes:
+        temps, callees = own[home], calls[home] = set(), set()
+        visited = set()
+        stack = [home] if home < len(insts) else []
+        while stack:
+            i = stack.pop()
+            if i in visited:
+                continue
+            visited.add(i)
+            inst = insts[i]
+            temps.update(w for w in inst.words if is_temp(w))
+            if i > 0 and inst.is_call(insts[i - 1]):
+                callees.add(inst.target)
+            stack.extend(successors(insts, i))
+    result = {home: set(temps) for home, temps in own.items()}
+    changed = True
+    while changed:  # calls may be mutually recursive
+        changed = False
+        for home, callees in calls.items():
+            temps = result[home]
+            size = len(temps)
+            for callee in callees:
+                temps |= result[callee]
+            changed = changed or len(temps) != size
+    return result
+
+
+def _rename(insts: List[Inst]):
+    """
+    Color the interference graph of temporaries greedily, in the order they appear.
+    Calling a function interferes its temporaries with those alive across the call.
+    """
+    if not insts:
+        return
+    clobbers = _callee_temps(insts)
+    starts = sorted(block_starts(insts) - {len(insts)})
+    block_of = {start: b for b, start in enumerate(starts)}
+    ends = starts[1:] + [len(insts)]
+
+    def call_clobbers(i: int) -> Set[str]:
+        inst = insts[i]
+        if inst.target is not None and i > 0 and inst.is_call(insts[i - 1]):
+            return clobbers[inst.target]
+        return set()
+
+    uses = [[w for w in inst.reads() if w.startswith(g.TEMP_PREFIX)] for inst in insts]
+    defs = [inst.writes() for inst in insts]
+    defs = [dest if dest is not None and dest.startswith(g.TEMP_PREFIX) else None for dest in defs]
+
+    # upward exposed uses and definitions of blocks
+    gen: List[Set[str]] = []
+    kill: List[Set[str]] = []
+    for start, end in zip(starts, ends):
+        used, defined = set(), set()
+        for i in range(start, end):
+            used.update(w for w in uses[i] if w not in defined)
+            if defs[i] is not None:
+                defined.add(defs[i])
+        gen.append(used)
+        kill.append(defined)
+    block_successors = [[block_of[s] for s in successors(insts, end - 1) if s in block_of] for end in ends]
+    predecessors: List[List[int]] = [[] for _ in starts]
+    for b, succs in enumerate(block_successors):
+        for s in succs:
+            predecessors[s].append(b)
+
+    live_in: List[Set[str]] = [set() for _ in starts]
+    live_out: List[Set[str]] = [set() for _ in starts]
+    worklist = list(range(len(starts)))
+    pending = set(worklist)
+    while worklist:
+        b = worklist.pop()
+        pending.discard(b)
+        out = set()
+        for s in block_successors[b]:
+            out |= live_in[s]
+        live_out[b] = out
+        new_in = gen[b] | (out - kill[b])
+        if new_in != live_in[b]:
+            live_in[b] = new_in
+            for p in predecessors[b]:
+                if p not in pending:
+                    pending.add(p)
+                    worklist.append(p)
+
+    order: Dict[str, int] = {}
+    for used, dest in zip(uses, defs):
+        for temp in used:
+            order.setdefault(temp, len(order))
+        if dest is not None:
+            order.setdefault(dest, len(order))
+    interference: Dict[str, Set[str]] = {}
+
+    def interfere(temp: str, others: Set[str]):
+        for other in others:
+            if other != temp:
+                interference.setdefault(temp, set()).add(other)
+                interference.setdefault(other, set()).add(temp)
+
+    for b, (start, end) in enumerate(zip(starts, ends)):
+        live = set(live_out[b])
+        for i in range(end - 1, start - 1, -1):
+            clobbered = call_clobbers(i)
+            for temp in clobbered:
+                interfere(temp, live)
+            dest = defs[i]
+            if dest is not None:
+                src = insts[i].words[2]
+                if insts[i].opcode == 'set' and src in live:
+                    interfere(dest, live - {src})  # a copy may share the name of its source
+                else:
+                    interfere(dest, live)
+                live.discard(dest)
+            live.update(uses[i])
+
+    names: Dict[str, str] = {}
+    colors: Dict[str, int] = {}
+    for temp in order:
+        taken = {colors[other] for other in interference.get(temp, ()) if other in colors}
+        color = 1
+        while color in taken:
+            color += 1
+        colors[temp] = color
+        names[temp] = f'{g.TEMP_PREFIX}{color}'
+    for inst, used, dest in zip(insts, uses, defs):
+        if used or dest is not None:
+            inst.words = [names.get(w, w) for w in inst.words]
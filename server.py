@@ -0,0 +1,163 @@
+"""
+Compile server: keeps the compiler loaded and answers compile requests over a Unix domain socket,
+so that editors and build tools do not pay for starting the interpreter and importing the compiler every time.
+
+Requests and responses are lines of JSON. A request is like
+    {"id": 1, "source": "x = 2 * y", "options": {"inline": false}}
+where `id` and `options` (fields of `g.Options`) are optional. The response repeats `id`, and has either
+    "code": ["op mul x 2 y"]
+or
+    "error": {"message": "Invalid expression.", "line": 1, "pos": 5}
+where `line` and `pos` are only present if the source is invalid.
+Requests on a connection are answered in order, while requests on different connections are compiled concurrently.
+"""
+import asyncio
+import copy
+import json
+import os
+import signal
+import socket
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any
+
+import g
+import mindc
+from cache import CompileCache
+
+# a request holds a whole source file, so lines may be long
+MAX_REQUEST_SIZE = 256 * 1024 * 1024
+
+
+def serve(path: str, options: Optional[g.Options] = None, cache: Optional[CompileCache] = None,
+          jobs: Optional[int] = None):
+    """
+    Serve until interrupted by SIGINT or SIGTERM.
+    :param path: Path of the socket. A stale socket left by a server that exited is replaced.
+    :param options: Compiling options that requests start from, or `None` for the defaults.
+    :param cache: The compile cache to consult, or `None` to always compile.
+    :param jobs: Maximum number of requests compiled at the same time, by default that of `ThreadPoolExecutor`.
+        Compiles hold the GIL, so more jobs mainly keep small requests from waiting for large ones.
+    :raise OSError: If another server is listening on `path`, or the socket cannot be created.
+    """
+    if os.path.exists(path):
+        with socket.socket(socket.AF_UNIX) as probe:
+            try:
+                probe.connect(path)
+            except OSError:
+                os.remove(path)  # stale
+            else:
+                raise OSError(f'Another server is listening on {path}.')
+    asyncio.run(_serve(path, options or g.Options(), cache, jobs))
+
+
+async def _serve(path: str, options: g.Options, cache: Optional[CompileCache], jobs: Optional[int]):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(jobs)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await loop.run_in_executor(executor, answer, line, options, cache)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass  # the client went away, or sent a line beyond the limit
+        finally:
+            writer.close()
+
+    server = await asyncio.start_unix_server(handle, path, limit=MAX_REQUEST_SIZE)
+    stopped = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+    try:
+        async with server:
+            await stopped.wait()
+    finally:
+        executor.shutdown(wait=False)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def answer(line: bytes, defaults: Optional[g.Options] = None, cache: Optional[CompileCache] = None) -> Dict[str, Any]:
+    """
+    :param line: A request.
+    :param defaults: Options to apply those of the request to.
+    :return: The response.
+    """
+    response: Dict[str, Any] = {}
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError('a request must be an object')
+        if 'id' in request:
+            response['id'] = request['id']
+        if not isinstance(request.get('source'), str):
+            raise ValueError('the source is missing')
+        options = _options(request.get('options') or {}, defaults or g.Options())
+    except ValueError as e:  # including JSONDecodeError and UnicodeDecodeError
+        response['error'] = {'message': f'Invalid request: {e}'}
+        return response
+    except RecursionError:
+        response['error'] = {'message': 'Invalid request: nested too deeply'}
+        return response
+    try:
+        response['code'] = mindc.compile(request['source'], options, cache)
+    except g.ParseError as e:
+        response['error'] = {'message': e.message, 'line': e.line, 'pos': e.pos}
+    except g.SizeError as e:
+        response['error'] = {'message': e.message}
+    except RecursionError:
+        response['error'] = {'message': 'The source is nested too deeply.'}
+    except Exception as e:  # a bug of the compiler, answered rather than dropping the connection
+        traceback.print_exc()
+        response['error'] = {'message': f'Internal error: {type(e).__name__}.'}
+    return response
+
+
+def _options(fields: Dict[str, Any], defaults: g.Options) -> g.Options:
+    if not isinstance(fields, dict):
+        raise ValueError('options must be an object')
+    options = copy.copy(defaults)
+    for name, value in fields.items():
+        if name not in vars(options):
+            raise ValueError(f'unknown option {name}')
+        expected = type(getattr(options, name))
+        if expected is float and type(value) is int:
+            value = float(value)  # JSON does not tell `1` from `1.0`
+        elif expected is tuple and type(value) is list and all(type(item) is str for item in value):
+            value = tuple(value)  # JSON has only lists
+        if type(value) is not expected:
+            raise ValueError(f'option {name} must be {expected.__name__}')
+        if expected in (int, float) and value < 0:
+            raise ValueError(f'option {name} must not be negative')
+        setattr(options, name, value)
+    return options
+
+
+def request(path: str, source: str, options: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    Compile by a server, as a client. Each call opens its own connection.
+    :param path: Path of the socket of the server.
+    :param options: Fields of `g.Options` different from the defaults.
+    :return: The compiled instructions, one per element.
+    :raise g.ParseError: If the source code is invalid.
+    :raise RuntimeError: If the server rejected the request, or the code does not fit in `max_instructions`.
+    """
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps({'source': source, 'options': options or {}}).encode() + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise RuntimeError('The server closed the connection.')
+    response = json.loads(line)
+    if 'error' in response:
+        error = response['error']
+        if 'line' in error:
+            raise g.ParseError(error['message'], error['line'], error['pos'])
+        raise RuntimeError(error['message'])
+    return response['code']
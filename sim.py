@@ -0,0 +1,292 @@
+"""
+Simulator of a Mindustry processor, for measuring the cost of compiled code without the game.
+Values are numbers (`float`), `None` for null, or strings, which also stand for objects such as buildings.
+Instructions the simulator does not model, e.g. `control` or `ucontrol`, take their time but have no effect.
+
+Usage: python3 sim.py [options] file   (a .mind file is compiled first, any other file is read as compiled code)
+"""
+import argparse
+import math
+import random
+import re
+import sys
+from typing import List, Dict, Optional, Union, Callable
+
+import g
+import mindc
+import ops
+
+Value = Union[float, str, None]
+
+DEFAULT_IPT = 8  # instructions per tick of a logic processor; micro processors run 2, hyper processors 25
+TICKS_PER_SECOND = 60
+MEMORY_SIZES = {'cell': 64, 'bank': 512}
+
+_constants: Dict[str, Value] = {
+    'null': None, 'true': 1.0, 'false': 0.0,
+    '@pi': math.pi, '@e': math.e, '@degToRad': math.pi / 180, '@radToDeg': 180 / math.pi,
+}
+
+_token_regex = re.compile(r'"[^"]*"|\S+')
+# names of linked buildings, which read as the buildings themselves rather than null
+_link_regex = re.compile(r'(?:switch|message|cell|bank|display|canvas|sorter|unloader|door|node)\d+')
+
+
+def _num(value: Value) -> float:
+    """
+    :return: The value as a number: 0 for null, 1 for other objects.
+    """
+    if isinstance(value, float):
+        return value
+    return 0.0 if value is None else 1.0
+
+
+def _equal(a: Value, b: Value) -> bool:
+    if isinstance(a, float) or isinstance(b, float) or a is None or b is None:
+        return abs(_num(a) - _num(b)) < 0.000001
+    return a == b
+
+
+def _strict_equal(a: Value, b: Value) -> bool:
+    return type(a) is type(b) and a == b
+
+
+def _format(value: Value) -> str:
+    """
+    :return: The text of `value` as printed by `print`.
+    """
+    if value is None:
+        return 'null'
+    if isinstance(value, str):
+        return value
+    if abs(value - ops.to_long(value)) < 0.00001:
+        return str(ops.to_long(value))
+    return repr(value)
+
+
+_conditions: Dict[str, Callable[[Value, Value], bool]] = {
+    'equal': _equal,
+    'notEqual': lambda a, b: not _equal(a, b),
+    'lessThan': lambda a, b: _num(a) < _num(b),
+    'lessThanEq': lambda a, b: _num(a) <= _num(b),
+    'greaterThan': lambda a, b: _num(a) > _num(b),
+    'greaterThanEq': lambda a, b: _num(a) >= _num(b),
+    'strictEqual': _strict_equal,
+    'always': lambda a, b: True,
+}
+
+
+class Processor:
+    """
+    A processor running compiled code. Variables and memory persist across runs, as in the game.
+    """
+
+    code: List[List[str]]
+    ipt: int  # instructions executed per tick
+    sensors: Dict[str, Value]  # readings of `sensor`, keyed like `switch1@enabled`, and global variables like `@unit`
+    variables: Dict[str, Value]
+    memory: Dict[str, List[float]]  # memory cells by name
+    messages: Dict[str, str]  # text flushed to each message block
+    counter: int
+    executed: int  # number of instructions executed
+    waited: float  # ticks spent in `wait`
+    passes: int  # number of times the program ran to its end and restarted
+    hits: List[int]  # number of times each instruction was executed
+    halted: bool
+    _buffer: List[str]  # text printed but not flushed yet
+    _random: random.Random
+
+    def __init__(self, code: List[str], ipt: int = DEFAULT_IPT, sensors: Optional[Dict[str, Value]] = None,
+                 seed: int = 0):
+        """
+        :param code: The instructions, one per element.
+        :param ipt: Instructions per tick.
+        :param sensors: Stubbed values of `sensor` readings and global variables. Missing ones read as null.
+        :param seed: Seed of `rand` and `noise`.
+        """
+        self.code = [_token_regex.findall(inst) for inst in code]
+        self.ipt = ipt
+        self.sensors = dict(sensors or {})
+        self.variables = {}
+        self.memory = {}
+        self.messages = {}
+        self.counter = 0
+        self.executed = 0
+        self.waited = 0.0
+        self.passes = 0
+        self.hits = [0] * len(code)
+        self.halted = False
+        self._buffer = []
+        self._random = random.Random(seed)
+
+    @property
+    def ticks(self) -> float:
+        """
+        :return: Ticks elapsed, as the processor executes `ipt` instructions each tick.
+        """
+        return math.ceil(self.executed / self.ipt) + self.waited
+
+    def run(self, passes: int = 1, max_instructions: int = 10 ** 7) -> bool:
+        """
+        Execute until the program has run to its end `passes` more times, or `stop` is executed.
+        :return: Whether it finished, rather than reaching `max_instructions`.
+        """
+        target = self.passes + passes
+        limit = self.executed + max_instructions
+        code = self.code
+        while self.passes < target and not self.halted:
+            if self.executed >= limit:
+                return False
+            if not 0 <= self.counter < len(code):
+                self.counter = 0
+            index = self.counter
+            self.counter += 1
+            self.executed += 1
+            self.hits[index] += 1
+            self._execute(code[index])
+            if not 0 <= self.counter < len(code):
+                self.passes += 1
+        return True
+
+    def _execute(self, words: List[str]):
+        opcode = words[0]
+        if opcode == 'set':
+            self._set(words[1], self._value(words[2]))
+        elif opcode == 'op':
+            self._set(words[2], self._operate(words[1], self._value(words[3]), self._value(words[4])))
+        elif opcode == 'jump':
+            a, b = (self._value(words[3]), self._value(words[4])) if len(words) > 4 else (None, None)
+            if _conditions[words[2]](a, b):
+                self.counter = int(words[1])
+        elif opcode == 'read':
+            cell = self._cell(self._value(words[2]))
+            index = int(_num(self._value(words[3])))
+            self._set(words[1], cell[index] if 0 <= index < len(cell) else 0.0)
+        elif opcode == 'write':
+            cell = self._cell(self._value(words[2]))
+            index = int(_num(self._value(words[3])))
+            if 0 <= index < len(cell):
+                cell[index] = _num(self._value(words[1]))
+        elif opcode == 'end':
+            self.counter = len(self.code)
+        elif opcode == 'stop':
+            self.counter -= 1
+            self.halted = True
+        elif opcode == 'print':
+            self._buffer.append(_format(self._value(words[1])))
+        elif opcode == 'printflush':
+            self.messages[str(self._value(words[1]))] = ''.join(self._buffer)
+            self._buffer.clear()
+        elif opcode == 'sensor':
+            self._set(words[1], self.sensors.get(f'{self._value(words[2])}{words[3]}'))
+        elif opcode == 'wait':
+            self.waited += _num(self._value(words[1])) * TICKS_PER_SECOND
+
+    def _value(self, word: str) -> Value:
+        if word in self.variables:
+            return self.variables[word]
+        if word in _constants:
+            return _constants[word]
+        if word[0] == '"':
+            return word[1:-1].replace('\\n', '\n')
+        number = ops.parse_number(word)
+        if number is not None:
+            return number
+        if word == '@counter':
+            return float(self.counter)
+        if word in self.sensors:
+            return self.sensors[word]
+        if word == '@ipt':
+            return float(self.ipt)
+        if word in ('@tick', '@time', '@second', '@minute'):
+            return self.ticks * {'@tick': 1, '@time': 1000 / TICKS_PER_SECOND, '@second': 1 / TICKS_PER_SECOND,
+                                 '@minute': 1 / TICKS_PER_SECOND / 60}[word]
+        if _link_regex.fullmatch(word):
+            return word
+        return None
+
+    def _set(self, name: str, value: Value):
+        if isinstance(value, float) and not math.isfinite(value):
+            value = None
+        if name == '@counter':
+            self.counter = int(_num(value))
+        elif name[0] != '@':
+            self.variables[name] = value
+
+    def _operate(self, operation: str, a: Value, b: Value) -> Value:
+        if operation in ('equal', 'notEqual', 'strictEqual'):
+            return float(_conditions[operation](a, b))
+        if operation == 'rand':
+            return self._random.random() * _num(a)
+        if operation == 'noise':
+            return math.sin(_num(a) * 12.9898 + _num(b) * 78.233)  # any smooth function will do for a stub
+        if operation not in ops.OPERATIONS:
+            raise ValueError(f'Unsupported operation {operation}.')
+        return ops.OPERATIONS[operation](_num(a), _num(b))
+
+    def _cell(self, cell_object: Value) -> List[float]:
+        name = str(cell_object)
+        cell = self.memory.get(name)
+        if cell is None:
+            size = next((size for prefix, size in MEMORY_SIZES.items() if name.startswith(prefix)), 64)
+            cell = self.memory[name] = [0.0] * size
+        return cell
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Run compiled code on a simulated Mindustry processor.')
+    parser.add_argument('file', help='a MindC source file (.mind), or compiled code')
+    parser.add_argument('--ipt', type=int, default=DEFAULT_IPT, metavar='N',
+                        help='instructions per tick (default: %(default)s)')
+    parser.add_argument('--passes', type=int, default=1, metavar='N',
+                        help='number of times to run the program to its end (default: %(default)s)')
+    parser.add_argument('--max-instructions', type=int, default=10 ** 7, metavar='N',
+                        help='stop after executing N instructions (default: %(default)s)')
+    parser.add_argument('--sensor', action='append', default=[], metavar='NAME=VALUE',
+                        help='stub a sensor reading like switch1@enabled=1, or a global variable like @unit=1')
+    parser.add_argument('--seed', type=int, default=0, help='seed of rand and noise')
+    parser.add_argument('--hits', action='store_true', help='list how many times each instruction was executed')
+    args = parser.parse_args()
+
+    sensors = {}
+    for item in args.sensor:
+        name, sep, value = item.partition('=')
+        if not sep:
+            parser.error(f'invalid sensor stub {item}')
+        number = ops.parse_number(value)
+        sensors[name] = number if number is not None else value
+
+    try:
+        with open(args.file) as f:
+            if args.file.endswith('.mind'):
+                code = mindc.compile_file(f)
+            else:
+                code = [line.strip() for line in f if line.strip()]
+    except IOError:
+        print('Failed to open source file.', file=sys.stderr)
+        return 1
+    except g.ParseError as e:
+        print(f'Line {e.line} Character {e.pos}: {e.message}', file=sys.stderr)
+        return 1
+
+    processor = Processor(code, args.ipt, sensors, args.seed)
+    try:
+        finished = processor.run(args.passes, args.max_instructions)
+    except (ValueError, KeyError, IndexError) as e:
+        print(f'Instruction {processor.counter - 1}: {e}', file=sys.stderr)
+        return 1
+    for name, text in processor.messages.items():
+        print(f'{name}: {text}')
+    if args.hits:
+        width = len(str(max(processor.hits, default=0)))
+        for index, (inst, hits) in enumerate(zip(code, processor.hits)):
+            print(f'{hits:>{width}}  {index:>4}  {inst}')
+    print(f'instructions: {processor.executed}')
+    print(f'ticks: {processor.ticks:g} ({args.ipt} instructions per tick)')
+    if not finished:
+        print(f'stopped after {args.max_instructions} instructions', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
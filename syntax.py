@@ -1,4 +1,4 @@
-from typing import Callable
+from typing import Iterator, Optional
 
 import lex
 from ir import *
@@ -6,23 +6,45 @@ from lex import Token, TokenType
 
 
 def program() -> Program:
+    prog = functions()
+    prog.main_procedure = list(main_procedure(prog))
+    return prog
+
+
+def functions() -> Program:
+    """
+    Parse the function definitions at the start of a program, leaving the main procedure to `main_procedure`.
+    """
     prog = Program()
-    g.context.append(prog)
+    context = g.unit().context
+    context.append(prog)
     while _peek() == TokenType.Def:
         f = function()
         prog.functions[f.name] = f
-    prog.main_procedure = stmt_list()
-    _expect(TokenType.EOF)
-    g.context.pop()
+    context.pop()
     return prog
 
 
+def main_procedure(prog: Program) -> Iterator[Statement]:
+    """
+    Parse the statements of the main procedure one at a time, so each can be processed before the next is parsed.
+    :param prog: The program with the functions parsed by `functions`.
+    """
+    context = g.unit().context
+    context.append(prog)
+    while _peek() in _statement_starts:
+        yield statement()
+    _expect(TokenType.EOF)
+    context.pop()
+
+
 def function() -> Function:
     func = Function()
     _expect(TokenType.Def)
     tk = _expect(TokenType.Identifier)
     func.name = tk.value
-    if func.name in g.context[0].functions or func.name in _builtin_functions:
+    context = g.unit().context
+    if func.name in context[0].functions or func.name in _builtin_functions:
         raise g.ParseError(f'Redefinition of function {func.name}.', tk.line, tk.pos)
     _expect(TokenType.LPara)
     if _peek() != TokenType.RPara:
@@ -38,39 +60,41 @@ def function() -> Function:
             func.param.append(param_name)
     _expect(TokenType.RPara)
     _expect(TokenType.LBrace)
-    g.context.append(func)
+    context.append(func)
     func.statements = stmt_list()
     if not any(x.returns() for x in func.statements):
         stmt = ReturnStmt()
         stmt.belong_func = func
         func.statements.append(stmt)
-    g.context.pop()
+    context.pop()
     _expect(TokenType.RBrace)
     return func
 
 
 def stmt_list() -> List[Statement]:
     sl = []
-    while _peek() in {TokenType.Identifier, TokenType.If, TokenType.While, TokenType.Return, TokenType.Break,
-                      TokenType.Continue, TokenType.Semicolon, TokenType.RawStmt, TokenType.LBrace}:
+    while _peek() in _statement_starts:
         s = statement()
         sl.append(s)
     return sl
 
 
 def statement() -> Statement:
+    first = lex.peek()
     parser, accept_semicolon = {
         TokenType.Identifier: (assign_stmt, True),
         TokenType.If: (cond_stmt, False),
         TokenType.While: (loop_stmt, False),
+        TokenType.Do: (do_loop_stmt, True),
         TokenType.Return: (return_stmt, True),
         TokenType.Break: (loop_ctrl_stmt, True),
         TokenType.Continue: (loop_ctrl_stmt, True),
         TokenType.Semicolon: (EmptyStmt, True),
         TokenType.RawStmt: (raw_stmt, False),
         TokenType.LBrace: (compound_stmt, False)
-    }[_peek()]
+    }[first.type_]
     s = parser()
+    s.line, s.pos = first.line, first.pos
     if accept_semicolon and _peek() == TokenType.Semicolon:
         lex.read()
     return s
@@ -107,16 +131,32 @@ def loop_stmt() -> Statement:
     _expect(TokenType.LPara)
     stmt.condition = expression()
     _expect(TokenType.RPara)
-    g.context.append(stmt)
+    context = g.unit().context
+    context.append(stmt)
     stmt.body = statement()
-    g.context.pop()
+    context.pop()
+    return stmt
+
+
+def do_loop_stmt() -> Statement:
+    stmt = DoLoopStmt()
+    _expect(TokenType.Do)
+    context = g.unit().context
+    context.append(stmt)
+    stmt.body = statement()
+    context.pop()
+    _expect(TokenType.While)
+    _expect(TokenType.LPara)
+    stmt.condition = expression()
+    _expect(TokenType.RPara)
     return stmt
 
 
 def return_stmt() -> Statement:
     stmt = ReturnStmt()
     tk = _expect(TokenType.Return)
-    func = g.context[1] if len(g.context) > 1 else None
+    context = g.unit().context
+    func = context[1] if len(context) > 1 else None
     if not isinstance(func, Function):
         raise g.ParseError('Unexpected return.', tk.line, tk.pos)
     stmt.belong_func = func
@@ -129,7 +169,7 @@ def return_stmt() -> Statement:
 def loop_ctrl_stmt() -> Statement:
     stmt = JumpStmt()
     tk = lex.read()
-    loop = g.context[-1]
+    loop = g.unit().context[-1]
     if not isinstance(loop, LoopStmt):
         raise g.ParseError('Unexpected loop control statement.', tk.line, tk.pos)
     if tk.type_ == TokenType.Break:
@@ -156,27 +196,81 @@ def compound_stmt() -> Statement:
 
 
 def expression() -> Expression:
-    return l_or_exp()
+    return _binary_exp(0)
+
+
+class _BinaryOperator:
+    """
+    How a binary operator joins its operands, see `_binary_exp`.
+    """
+
+    __slots__ = ('precedence', 'inst', 'set_bool', 'type_is_bool', 'logical')
+
+    precedence: int  # higher binds tighter
+    inst: str  # of the `OperationExpr`, or of the `LogicalExpr` if `logical`
+    set_bool: Optional[bool]  # as of `OperationExpr`
+    type_is_bool: bool  # whether the expression is a comparison
+    logical: bool  # whether it is `&&` or `||`, which shortcut
+
+    def __init__(self, precedence: int, inst: str, set_bool: Optional[bool] = None, type_is_bool: bool = False,
+                 logical: bool = False):
+        self.precedence = precedence
+        self.inst = inst
+        self.set_bool = set_bool
+        self.type_is_bool = type_is_bool
+        self.logical = logical
+
+
+_binary_operators = {
+    TokenType.LOrOp: _BinaryOperator(1, 'or', logical=True),
+    TokenType.LAndOp: _BinaryOperator(2, 'and', logical=True),
+    TokenType.BOrOp: _BinaryOperator(3, 'or'),
+    TokenType.BXorOp: _BinaryOperator(4, 'xor'),
+    TokenType.BAndOp: _BinaryOperator(5, 'and'),
+    TokenType.EqOp: _BinaryOperator(6, 'equal', True, True),
+    TokenType.NeqOp: _BinaryOperator(6, 'notEqual', True, True),
+    TokenType.LtOp: _BinaryOperator(7, 'lessThan', True, True),
+    TokenType.GtOp: _BinaryOperator(7, 'greaterThan', True, True),
+    TokenType.LeqOp: _BinaryOperator(7, 'lessThanEq', True, True),
+    TokenType.GeqOp: _BinaryOperator(7, 'greaterThanEq', True, True),
+    TokenType.LShiftOp: _BinaryOperator(8, 'shl', False),
+    TokenType.RShiftOp: _BinaryOperator(8, 'shr', False),
+    TokenType.AddOp: _BinaryOperator(9, 'add', False),
+    TokenType.SubOp: _BinaryOperator(9, 'sub', False),
+    TokenType.MulOp: _BinaryOperator(10, 'mul'),
+    TokenType.DivOp: _BinaryOperator(10, 'div'),
+    TokenType.ModOp: _BinaryOperator(10, 'mod'),
+    TokenType.FloorDivOp: _BinaryOperator(10, 'idiv'),
+    TokenType.PowOp: _BinaryOperator(11, 'pow'),
+}
 
+_unary_operators = {TokenType.AddOp, TokenType.SubOp, TokenType.BNotOp, TokenType.LNotOp}
 
-def _create_expr_parser(sub_expr_parser: Callable[[], Expression], set_bool: Optional[bool], ops: Dict[TokenType, str],
-                        type_is_bool: bool = False, convert_operand: bool = True) -> Callable[[], Expression]:
-    def parser() -> Expression:
-        exp = sub_expr_parser()
-        while _peek() in ops:
-            op = ops[lex.read().type_]
-            exp = OperationExpr(op, exp, sub_expr_parser(), set_bool, convert_operand)
-            if type_is_bool:
-                exp.type_is_bool = True
-        return exp
 
-    return parser
+def _binary_exp(min_precedence: int) -> Expression:
+    """
+    Parse operands joined by binary operators of at least `min_precedence`, all of which associate to the left,
+    by precedence climbing. Each operand takes a single call, rather than one for each level of precedence.
+    """
+    exp = unary_exp()
+    while True:
+        op = _binary_operators.get(_peek())
+        if op is None or op.precedence < min_precedence:
+            return exp
+        lex.read()
+        opr2 = _binary_exp(op.precedence + 1)
+        if op.logical:
+            exp = LogicalExpr(op.inst, exp, opr2)
+        else:
+            exp = OperationExpr(op.inst, exp, opr2, op.set_bool)
+            if op.type_is_bool:
+                exp.type_is_bool = True
 
 
 def unary_exp() -> Expression:
     operations = []
     double_not = ()
-    while _peek() in {TokenType.AddOp, TokenType.SubOp, TokenType.BNotOp, TokenType.LNotOp}:
+    while _peek() in _unary_operators:
         op = lex.read().type_
         if op == TokenType.AddOp:
             pass
@@ -204,29 +298,6 @@ def unary_exp() -> Expression:
     return exp
 
 
-pow_exp = _create_expr_parser(unary_exp, None, {TokenType.PowOp: 'pow'})
-mul_exp = _create_expr_parser(pow_exp, None, {
-    TokenType.MulOp: 'mul',
-    TokenType.DivOp: 'div',
-    TokenType.ModOp: 'mod',
-    TokenType.FloorDivOp: 'idiv'
-})
-plus_exp = _create_expr_parser(mul_exp, False, {TokenType.AddOp: 'add', TokenType.SubOp: 'sub'})
-shift_exp = _create_expr_parser(plus_exp, False, {TokenType.LShiftOp: 'shl', TokenType.RShiftOp: 'shr'})
-comp_exp = _create_expr_parser(shift_exp, True, {
-    TokenType.LtOp: 'lessThan',
-    TokenType.GtOp: 'greaterThan',
-    TokenType.LeqOp: 'lessThanEq',
-    TokenType.GeqOp: 'greaterThanEq'
-}, True)
-eq_exp = _create_expr_parser(comp_exp, True, {TokenType.EqOp: 'equal', TokenType.NeqOp: 'notEqual'}, True)
-b_and_exp = _create_expr_parser(eq_exp, None, {TokenType.BAndOp: 'and'})
-b_xor_exp = _create_expr_parser(b_and_exp, None, {TokenType.BXorOp: 'xor'})
-b_or_exp = _create_expr_parser(b_xor_exp, None, {TokenType.BOrOp: 'or'})
-l_and_exp = _create_expr_parser(b_or_exp, True, {TokenType.LAndOp: 'land'}, True, convert_operand=False)
-l_or_exp = _create_expr_parser(l_and_exp, None, {TokenType.LOrOp: 'or'}, True, convert_operand=False)
-
-
 def base_exp() -> Expression:
     type_ = _peek()
     if type_ == TokenType.LPara:
@@ -256,7 +327,7 @@ def base_exp() -> Expression:
 def call(func_name_tk: Token) -> Expression:
     # determine if the function is builtin
     func_name = func_name_tk.value
-    prog: Program = g.context[0]
+    prog: Program = g.unit().context[0]
     func = prog.functions.get(func_name)
     if func is not None:
         param_num = len(func.param)
@@ -292,6 +363,7 @@ def call(func_name_tk: Token) -> Expression:
         second_operand = args[1] if param_num == 2 else BaseExpr.zero()
         return OperationExpr(func_name, exp, second_operand, set_bool)
     else:  # custom function
+        func.call_count += 1
         return FunctionExpr(func, args)
 
 
@@ -302,6 +374,9 @@ _builtin_functions = {
 _builtin_bool_identity = {'abs', 'floor', 'ceil', 'sqrt'}
 _builtin_preserve_bool = {'max', 'min'}
 
+_statement_starts = {TokenType.Identifier, TokenType.If, TokenType.While, TokenType.Do, TokenType.Return,
+                     TokenType.Break, TokenType.Continue, TokenType.Semicolon, TokenType.RawStmt, TokenType.LBrace}
+
 
 def _expect(type_: TokenType) -> Token:
     tk = lex.read()
@@ -0,0 +1,23 @@
+"""
+Running compiled code on the simulated processor, to compare the behavior of programs compiled
+with different options.
+"""
+from typing import Dict, List, Optional
+
+import g
+import mindc
+import sim
+
+
+def run(source: str, options: Optional[g.Options] = None,
+        memory: Optional[Dict[str, List[float]]] = None) -> sim.Processor:
+    """
+    :param source: The source code.
+    :param options: Compiling options, or `None` for the defaults.
+    :param memory: The initial contents of memory cells by name, copied. Missing cells are zeroed.
+    :return: The processor after one run of the compiled code.
+    """
+    processor = sim.Processor(mindc.compile(source, options))
+    processor.memory.update((name, list(cell)) for name, cell in (memory or {}).items())
+    processor.run()
+    return processor
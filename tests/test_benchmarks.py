@@ -0,0 +1,23 @@
+import unittest
+
+import g
+from benchmarks import suite
+from helpers import run
+
+
+class ExpressionsTest(unittest.TestCase):
+    def test_same_as_unoptimized(self):
+        # the operands are read from memory, so that nothing is folded and the expressions take various values
+        names = [f'a{k}' for k in range(13)] + [f'b{k}' for k in range(11)] + [f'c{k}' for k in range(17)] + \
+            [f'd{k}' for k in range(1, 48)]
+        source = ''.join(f'{name} = bank1[{k}]\n' for k, name in enumerate(names)) + suite.expressions_source(30)
+        memory = {'bank1': [float(k % 23 - 7) + (k % 3) / 4 for k in range(512)]}
+        unoptimized, optimized = run(source, g.Options.level('0'), memory), run(source, None, memory)
+        values = [unoptimized.variables[f'x{i}'] for i in range(30)]
+        self.assertTrue(any(value not in (None, 0) for value in values))
+        self.assertEqual(values, [optimized.variables[f'x{i}'] for i in range(30)])
+        self.assertEqual(unoptimized._buffer, optimized._buffer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+import cse
+import g
+import mindc
+from cfg import Inst
+from helpers import run
+
+OWNED = g.Options(owned_cells=('cell1',))
+
+
+class OwnedCellTest(unittest.TestCase):
+    def test_write_to_owned_cell(self):
+        self.assertEqual(['cell1'], cse._may_write(Inst(['write', 'x', 'cell1', '3']), ('cell1', 'bank1')))
+
+    def test_write_through_variable(self):
+        # `c` may hold any owned cell
+        self.assertEqual(['cell1', 'bank1'], cse._may_write(Inst(['write', 'x', 'c', 'i']), ('cell1', 'bank1')))
+        source = 'c = cell1\nx = cell1[3]\nc[3] = x + 1\ny = cell1[3]\ncell2[0] = y\n'
+        self.assertEqual(1, run(source, OWNED).memory['cell2'][0])
+
+    def test_store_forwarded(self):
+        source = 'cell1[3] = 5\ny = cell1[3]\ncell2[0] = y\n'
+        self.assertNotIn('read', ' '.join(mindc.compile(source, OWNED)))
+        self.assertEqual(5, run(source, OWNED).memory['cell2'][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
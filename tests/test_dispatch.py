@@ -0,0 +1,35 @@
+import unittest
+
+import g
+import mindc
+from helpers import run
+
+
+def chain(states) -> str:
+    """
+    :return: A state machine writing a value for each state to `cell2[0]`, and -1 if none matches.
+    """
+    arms = [f'if (state == {s}) {{\n    cell2[0] = {s * 10 + 1}\n}}' for s in states]
+    return 'state = cell1[0]\n' + ' else '.join(arms) + ' else {\n    cell2[0] = -1\n}\n'
+
+
+class JumpTableTest(unittest.TestCase):
+    def assert_same(self, source: str, values):
+        self.assertIn('op add @counter @counter', ' '.join(mindc.compile(source)))  # dispatched through a table
+        for value in values:
+            memory = {'cell1': [float(value)] + [0.0] * 63}
+            self.assertEqual(run(source, g.Options.level('0'), memory).memory['cell2'],
+                             run(source, None, memory).memory['cell2'], value)
+
+    def test_from_zero_with_gaps(self):
+        states = [s for s in range(24) if s not in (7, 13)]
+        self.assert_same(chain(states), [-1, 0, 1, 6, 7, 13, 14, 23, 24, 100, 2.5, -0.5, 22.9])
+        self.assertEqual(141, run(chain(states), None, {'cell1': [14.0]}).memory['cell2'][0])
+
+    def test_from_offset(self):
+        self.assert_same(chain(range(5, 25)), [0, 4, 5, 6, 24, 25, 5.5, 4.9, 24.1])
+        self.assertEqual(61, run(chain(range(5, 25)), None, {'cell1': [6.0]}).memory['cell2'][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
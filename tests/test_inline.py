@@ -0,0 +1,29 @@
+import unittest
+
+import g
+import mindc
+from helpers import run
+
+# f(0) runs past the end of the body, leaving the value returned by the previous call
+FALLS_OFF = 'def f(x) {\n    if (x > 1) {\n        return x * 2\n    }\n}\n'
+
+
+class InliningTest(unittest.TestCase):
+    def assert_same(self, source: str):
+        self.assertEqual(run(source, g.Options.level('0')).memory, run(source).memory)
+
+    def test_value_used_after_falling_off(self):
+        self.assert_same(FALLS_OFF + 'cell2[0] = f(5)\ncell2[1] = f(0)\n')
+
+    def test_value_used_after_return_without_value(self):
+        self.assert_same('def f(x) {\n    if (x > 1) {\n        return x * 2\n    }\n    return\n}\n'
+                         'cell2[0] = f(5)\ncell2[1] = f(0)\n')
+
+    def test_value_discarded(self):
+        source = FALLS_OFF + 'cell2[0] = 1\n_ = f(5)\n_ = f(0)\n'
+        self.assertNotIn('$ra$f', ' '.join(mindc.compile(source)))  # still inlined
+        self.assert_same(source)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+import g
+from helpers import run
+
+
+class InductionTest(unittest.TestCase):
+    def assert_same(self, source: str):
+        self.assertEqual(run(source, g.Options(optimize_loops=False)).memory, run(source).memory)
+
+    def test_integer_step(self):
+        self.assert_same('i = 0\nbase = cell1[5]\nwhile (i < 20) {\n    bank2[i] = floor(i * 3 + base)\n'
+                         '    i = i + 1\n}\n')
+
+    def test_fractional_step(self):
+        # i drifts from the multiples of 0.1, so i * 3 and a temporary stepped by 0.3 floor differently
+        self.assert_same('i = 0\nn = 0\nbase = cell1[5]\nwhile (i < 20) {\n    bank2[n] = floor(i * 3 + base)\n'
+                         '    n = n + 1\n    i = i + 0.1\n}\n')
+
+    def test_fractional_factor(self):
+        self.assert_same('i = 0\nbase = cell1[5]\nwhile (i < 200) {\n    bank2[i] = floor(i * 0.1 + base)\n'
+                         '    i = i + 1\n}\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import json
+import unittest
+from unittest import mock
+
+import mindc
+import server
+
+
+def answer(request: dict) -> dict:
+    return server.answer(json.dumps(request).encode())
+
+
+class AnswerTest(unittest.TestCase):
+    def test_code(self):
+        self.assertEqual({'id': 1, 'code': ['set x 1', 'print x']}, answer({'id': 1, 'source': 'x = 1\n$ print x\n'}))
+
+    def test_negative_option(self):
+        for name in ('inline_budget', 'max_instructions', 'speed_weight'):
+            response = answer({'id': 2, 'source': 'x = 1', 'options': {name: -1}})
+            self.assertEqual(2, response['id'])
+            self.assertIn(f'option {name} must not be negative', response['error']['message'])
+
+    def test_internal_error(self):
+        with mock.patch.object(mindc, 'compile', side_effect=KeyError('x')), mock.patch('traceback.print_exc'):
+            self.assertEqual({'id': 3, 'error': {'message': 'Internal error: KeyError.'}},
+                             answer({'id': 3, 'source': 'x = 1'}))
+
+    def test_undecodable(self):
+        self.assertIn('Invalid request', server.answer(b'{"source": "\xff"}')['error']['message'])
+
+
+if __name__ == '__main__':
+    unittest.main()